@@ -27,20 +27,30 @@ This script enforces the "极简两入口" layout:
 
 Credentials are injected via env vars (recommended):
   RESI_SERVER / RESI_PORT / RESI_USERNAME / RESI_PASSWORD
+
+No YAML library is used (stdlib only): the file is indexed once as lines (_YamlIndex),
+edits are queued against that index and rendered in a single pass, so every untouched
+line (comments, quoting, key order) is written back byte-for-byte.
 """
 
 from __future__ import annotations
 
 import argparse
 import datetime as _dt
+import functools
+import hashlib
+import io
+import json
 import os
-import subprocess
-import ipaddress
+from dataclasses import dataclass, field
+from itertools import chain, count, islice
 from pathlib import Path
-from typing import Tuple, Optional, List
+from typing import Callable, Dict, Iterator, Tuple, Optional, List, Sequence
 import fnmatch
 import re
-from collections import OrderedDict
+import shutil
+import sys
+import tempfile
 
 
 # ====== CONFIG (sanitized) ======
@@ -70,15 +80,15 @@ RESI_NODE_SELECT_MODE_ENV = "RESI_NODE_SELECT_MODE"
 # - 支持 glob：* ? [abc]
 # - 也支持正则：以 "re:" 开头（例如 r"re:^🇺🇲\\s*美国\\s*\\d+$"）
 # - 如果你的订阅命名风格不同，请在这里加/改模式
-US_NODE_PATTERNS = [
+US_NODE_PATTERNS = (
     "🇺🇲 美国 *",
     "🇺🇸 *",
     "US *",
     "United States *",
-]
+)
 
 # 如果模式没匹配到任何节点，就回退到这个列表（避免生成空组）
-US_NODES_FALLBACK = ["🇺🇲 美国 01", "🇺🇲 美国 02", "🇺🇲 美国 03"]
+US_NODES_FALLBACK = ("🇺🇲 美国 01", "🇺🇲 美国 02", "🇺🇲 美国 03")
 
 GROUP_US_RELAY = "🇺🇲 美国-中继择优"  # legacy, no longer generated
 GROUP_ONECLICK = "🏠 住宅出口"  # legacy, no longer generated
@@ -93,13 +103,13 @@ FEATURE_BYPASS = "bypass"
 ENABLE_HK_RELAY_LANDING = False
 
 # 香港节点匹配（从 `proxies:` 里的所有节点 name 中匹配）
-HK_NODE_PATTERNS = [
+HK_NODE_PATTERNS = (
     "🇭🇰 香港 *",
     "HK *",
     "Hong Kong *",
     "🇭🇰 *",
-]
-HK_NODES_FALLBACK = ["🇭🇰 香港 01", "🇭🇰 香港 02", "🇭🇰 香港 03"]
+)
+HK_NODES_FALLBACK = ("🇭🇰 香港 01", "🇭🇰 香港 02", "🇭🇰 香港 03")
 
 # 香港中继组名（url-test）
 GROUP_HK_RELAY = "🇭🇰 香港-中继择优"
@@ -127,6 +137,8 @@ DIALER_SELECTOR_CANDIDATES = [
 ]
 
 TOPLEVEL_PORT = 7891
+# Write buffer size for the patched YAML.
+OUTPUT_BUFFER_SIZE = 16 * 1024
 HEALTHCHECK_URL = "http://www.gstatic.com/generate_204"
 HEALTHCHECK_INTERVAL = 300
 HEALTHCHECK_TOLERANCE = 50
@@ -168,17 +180,35 @@ INJECT_REGION_GROUPS_INTO_NODE_SELECT = False
 
 
 def _split_lines_keepends(s: str) -> List[str]:
-    return s.splitlines(keepends=True)
+    # Split on "\n" only: str.splitlines() would also break inside values at
+    # \x0b/\x0c/\x1c-\x1e/\x85/\u2028/\u2029, which YAML treats as ordinary characters.
+    return io.StringIO(s, newline="\n").readlines()
 
 
-def _section_bounds(text: str, header: str, next_header: str) -> Tuple[int, int]:
-    i = text.find(header)
-    if i < 0:
-        raise ValueError(f"Missing section header: {header!r}")
-    j = text.find(next_header, i + len(header))
-    if j < 0:
-        raise ValueError(f"Missing section header: {next_header!r}")
-    return i, j
+def _read_yaml_text(path: Path) -> str:
+    """Read `path` as UTF-8 text with universal newlines, like Path.read_text()."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = max(os.fstat(fd).st_size, 1 << 16)
+        chunks = []
+        while True:
+            chunk = os.read(fd, size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+    text = b"".join(chunks).decode("utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def _section_bounds(index: "_YamlIndex", key: str) -> Tuple[int, int]:
+    start, end = index.block(key)
+    if start is None:
+        raise ValueError(f"Missing section header: {key + ':'!r}")
+    return start, end
 
 
 def _parse_csv_env_list(var_name: str) -> List[str]:
@@ -187,11 +217,25 @@ def _parse_csv_env_list(var_name: str) -> List[str]:
         return []
     # Special value: "system" / "auto" -> detect current macOS system DNS
     if raw.lower() in {"system", "auto"}:
-        return _get_macos_system_dns()
+        return list(_get_macos_system_dns())
     parts = [p.strip() for p in raw.split(",")]
     return [p for p in parts if p]
 
 
+# Env vars read by the resi part of _apply_env_overrides()
+_RESI_OVERRIDE_ENV_KEYS = (
+    "RESI_SERVER",
+    "RESI_PORT",
+    "RESI_USERNAME",
+    "RESI_PASSWORD",
+    RESI_PROXY_NAME_ENV,
+    RESI_GROUP_DIALER_NAME_ENV,
+    RESI_GROUP_ONECLICK_NAME_ENV,
+    RESI_GROUP_NODE_SELECT_NAME_ENV,
+    RESI_GROUP_DIALER_SELECTOR_NAME_ENV,
+)
+
+
 def _apply_env_overrides() -> None:
     """
     Apply env overrides to bypass config (sanitized/open-source friendly).
@@ -200,62 +244,72 @@ def _apply_env_overrides() -> None:
     global GROUP_ALL_NODES_BEST, GROUP_ONECLICK, GROUP_NODE_SELECT, GROUP_DIALER_SELECTOR
     global RESI_PROXY
 
-    ip_raw = os.getenv(BYPASS_IP_CIDRS_ENV, "").strip()
+    env = os.environ
+    ip_raw = env.get(BYPASS_IP_CIDRS_ENV, "").strip()
     if ip_raw:
         BYPASS_IP_CIDRS = [p.strip() for p in ip_raw.split(",") if p.strip()]
 
-    dom_raw = os.getenv(BYPASS_DOMAINS_ENV, "").strip()
+    dom_raw = env.get(BYPASS_DOMAINS_ENV, "").strip()
     if dom_raw:
         BYPASS_DOMAINS = [p.strip().lstrip(".") for p in dom_raw.split(",") if p.strip()]
 
     BYPASS_FAKEIP_FILTER = [f"+.{d}" for d in BYPASS_DOMAINS]
 
+    # No resi override set: nothing else to apply.
+    if not any(k in env for k in _RESI_OVERRIDE_ENV_KEYS):
+        return
+
     # resi credentials/endpoint overrides
     # NOTE: RESI_PROXY was initialized at import-time; .env is loaded later in main(),
     # so we must refresh these fields here to actually pick up values from .env.
-    resi_server = os.getenv("RESI_SERVER", "").strip()
+    resi_server = env.get("RESI_SERVER", "").strip()
     if resi_server:
         RESI_PROXY["server"] = resi_server
-    resi_port = os.getenv("RESI_PORT", "").strip()
+    resi_port = env.get("RESI_PORT", "").strip()
     if resi_port:
         try:
             RESI_PROXY["port"] = int(resi_port)
         except Exception:
             # keep existing value if invalid
             pass
-    resi_user = os.getenv("RESI_USERNAME", "").strip()
+    resi_user = env.get("RESI_USERNAME", "").strip()
     if resi_user:
         RESI_PROXY["username"] = resi_user
-    resi_pass = os.getenv("RESI_PASSWORD", "").strip()
+    resi_pass = env.get("RESI_PASSWORD", "").strip()
     if resi_pass:
         RESI_PROXY["password"] = resi_pass
 
     # resi naming overrides (no secrets, safe for open-source)
-    resi_proxy_name = os.getenv(RESI_PROXY_NAME_ENV, "").strip()
+    resi_proxy_name = env.get(RESI_PROXY_NAME_ENV, "").strip()
     if resi_proxy_name:
         RESI_PROXY["name"] = resi_proxy_name
 
-    dialer_group_name = os.getenv(RESI_GROUP_DIALER_NAME_ENV, "").strip()
+    dialer_group_name = env.get(RESI_GROUP_DIALER_NAME_ENV, "").strip()
     if dialer_group_name:
         GROUP_ALL_NODES_BEST = dialer_group_name
 
-    oneclick_group_name = os.getenv(RESI_GROUP_ONECLICK_NAME_ENV, "").strip()
+    oneclick_group_name = env.get(RESI_GROUP_ONECLICK_NAME_ENV, "").strip()
     if oneclick_group_name:
         GROUP_ONECLICK = oneclick_group_name
 
-    node_select_group_name = os.getenv(RESI_GROUP_NODE_SELECT_NAME_ENV, "").strip()
+    node_select_group_name = env.get(RESI_GROUP_NODE_SELECT_NAME_ENV, "").strip()
     if node_select_group_name:
         # Don't blindly assume it exists; we'll verify against YAML later and fallback safely.
         GROUP_NODE_SELECT = node_select_group_name
 
-    dialer_selector_name = os.getenv(RESI_GROUP_DIALER_SELECTOR_NAME_ENV, "").strip()
+    dialer_selector_name = env.get(RESI_GROUP_DIALER_SELECTOR_NAME_ENV, "").strip()
     if dialer_selector_name:
         GROUP_DIALER_SELECTOR = dialer_selector_name
 
 
-def _select_dialer_candidates(all_proxy_names_in_order: List[str]) -> Tuple[List[str], Optional[str]]:
+def _select_dialer_candidates(
+    all_proxy_names_in_order: List[str],
+    mode: Optional[str] = None,
+    pattern: Optional[str] = None,
+) -> Tuple[List[str], Optional[str]]:
     """
     Decide which upstream nodes are used as dialer candidates for the residential proxy.
+    `mode` / `pattern` default to RESI_DIALER_MODE / RESI_DIALER_REGEX from the env.
     Returns (candidates, warning_message).
     """
     # Exclude residential proxy itself and special variants.
@@ -263,12 +317,14 @@ def _select_dialer_candidates(all_proxy_names_in_order: List[str]) -> Tuple[List
     if not candidates:
         return [], "resi: no dialer candidates found in proxies section"
 
-    mode = os.getenv(RESI_DIALER_MODE_ENV, "all").strip().lower() or "all"
+    if mode is None:
+        mode = os.getenv(RESI_DIALER_MODE_ENV, "all").strip().lower() or "all"
     if mode == "all":
         return candidates, None
 
     if mode == "regex":
-        pattern = os.getenv(RESI_DIALER_REGEX_ENV, "").strip()
+        if pattern is None:
+            pattern = os.getenv(RESI_DIALER_REGEX_ENV, "").strip()
         if not pattern:
             return candidates, f"resi: {RESI_DIALER_MODE_ENV}=regex but {RESI_DIALER_REGEX_ENV} is empty; falling back to all"
         try:
@@ -283,18 +339,16 @@ def _select_dialer_candidates(all_proxy_names_in_order: List[str]) -> Tuple[List
     return candidates, f"resi: unknown {RESI_DIALER_MODE_ENV}={mode!r}; falling back to all"
 
 
+# mihomo/Clash.Meta-only keys
+_COMPAT_RE = re.compile(r"dialer-proxy:|geodata-mode:|sniffer:|external-controller:")
+
+
 def _detect_compat_from_text(text: str) -> str:
     """
     Best-effort detection (since we patch YAML offline).
     Returns: "mihomo" or "classic".
     """
-    mihomo_hints = [
-        "dialer-proxy:",
-        "geodata-mode:",
-        "sniffer:",
-        "external-controller:",
-    ]
-    return "mihomo" if any(h in text for h in mihomo_hints) else "classic"
+    return "mihomo" if _COMPAT_RE.search(text) else "classic"
 
 
 def _resolve_compat(compat_arg: str, yaml_text: str) -> str:
@@ -340,45 +394,37 @@ def _load_env_file(env_path: str, *, override: bool = True) -> List[str]:
     return loaded
 
 
-def _get_macos_system_dns() -> List[str]:
+_SCUTIL_NS_RE = re.compile(r"^\s*nameserver\[\d+\]\s*:\s*(\S+)", re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_macos_system_dns() -> Tuple[str, ...]:
     """
     Best-effort: read current macOS DNS servers via `scutil --dns`.
-    Returns a de-duplicated list, preferring private (RFC1918) nameservers first.
+    Returns a de-duplicated tuple, preferring private (RFC1918) nameservers first.
+    Cached for the rest of the run.
     """
+    # Only needed for BYPASS_INTERNAL_DNS=system / --print-system-dns.
+    import ipaddress
+    import subprocess
+
     try:
-        out = subprocess.check_output(["scutil", "--dns"], text=True, stderr=subprocess.STDOUT)
+        out = subprocess.run(["scutil", "--dns"], capture_output=True, text=True, check=False).stdout
     except Exception:
-        return []
+        return ()
 
-    servers: List[str] = []
-    for ln in out.splitlines():
-        s = ln.strip()
-        # e.g. "nameserver[0] : 10.0.0.2"
-        if not s.startswith("nameserver["):
-            continue
-        if ":" not in s:
-            continue
-        ip = s.split(":", 1)[1].strip()
-        if not ip:
-            continue
+    # Ordered dedupe: nameserver -> is_private.
+    servers: Dict[str, bool] = {}
+    # e.g. "nameserver[0] : 10.0.0.2"
+    for ip in dict.fromkeys(_SCUTIL_NS_RE.findall(out or "")):
         try:
-            ipaddress.ip_address(ip)
+            servers[ip] = ipaddress.ip_address(ip).is_private
         except Exception:
             continue
-        servers.append(ip)
 
-    seen = set()
-    servers = [x for x in servers if not (x in seen or seen.add(x))]
-
-    def is_private_ip(x: str) -> bool:
-        try:
-            return ipaddress.ip_address(x).is_private
-        except Exception:
-            return False
-
-    private = [x for x in servers if is_private_ip(x)]
-    public = [x for x in servers if not is_private_ip(x)]
-    return private + public
+    private = [x for x, is_private in servers.items() if is_private]
+    public = [x for x, is_private in servers.items() if not is_private]
+    return tuple(private + public)
 
 
 def _parse_features(features_str: str) -> "set[str]":
@@ -423,70 +469,244 @@ def _explain(features: "set[str]") -> str:
     return "\n".join(lines)
 
 
-def _find_top_level_block(lines: List[str], key: str) -> Tuple[Optional[int], Optional[int]]:
+def _unquote(s: str) -> str:
+    s = s.strip()
+    if len(s) >= 2 and s[0] == s[-1] and s[0] in {"'", '"'}:
+        return s[1:-1]
+    return s
+
+
+# YAML quoted scalars: '' escapes a quote in single quotes, backslash escapes in double quotes
+_SQ_BODY = r"((?:[^'\n]|'')*)"
+_DQ_BODY = r'((?:[^"\\\n]|\\.)*)'
+_SQ_SCALAR_RE = re.compile("'" + _SQ_BODY + "'")
+_DQ_SCALAR_RE = re.compile('"' + _DQ_BODY + '"')
+
+
+def _unescape_sq(body: str) -> str:
+    return body.replace("''", "'")
+
+
+def _unescape_dq(body: str) -> str:
+    if "\\" not in body:
+        return body
+    try:
+        # JSON string escapes are a subset of YAML's double-quoted ones
+        return json.loads(f'"{body}"')
+    except ValueError:
+        return body
+
+
+def _yaml_sq(s: str) -> str:
+    """`s` as the body of a single-quoted YAML scalar."""
+    return s.replace("'", "''")
+
+
+def _name_scalar(s: str) -> str:
+    """A scalar value (e.g. of a `name:` line) with quoting resolved and a trailing ` # comment` removed."""
+    s = s.strip()
+    if s[:1] == "'":
+        m = _SQ_SCALAR_RE.match(s)
+        if m:
+            return _unescape_sq(m.group(1))
+    elif s[:1] == '"':
+        m = _DQ_SCALAR_RE.match(s)
+        if m:
+            return _unescape_dq(m.group(1))
+    elif " #" in s:
+        s = s.split(" #", 1)[0]
+    return _unquote(s)
+
+
+def _line_scalars(s: str) -> List[str]:
     """
-    Find a top-level YAML block:
-      key:
-        ...
-    Returns (start_idx, end_idx_exclusive) over `lines`.
+    Best-effort scalars on one stripped YAML line (quotes removed):
+      - item        -> [item]
+      key: value    -> [key, value]
+      key: [a, b]   -> [key, a, b]
+    Only used for "already present?" checks, not as a real YAML parser.
     """
-    start = None
-    for i, ln in enumerate(lines):
-        if ln.startswith(f"{key}:\n") or ln.rstrip("\n") == f"{key}:":
-            start = i
-            break
-    if start is None:
-        return None, None
-    j = start + 1
-    while j < len(lines):
-        s = lines[j]
-        if s.strip() == "" or s.startswith("#") or s.startswith(" "):
-            j += 1
-            continue
-        break
-    return start, j
+    if s == "-":
+        return []
+    if s.startswith("- "):
+        return [_unquote(s[2:])]
+    if s[:1] in {"'", '"'}:
+        close = s.find(s[0], 1)
+        if close < 0:
+            return [s]
+        key, rest = s[1:close], s[close + 1 :].lstrip()
+        rest = rest[1:] if rest.startswith(":") else ""
+    elif ":" in s:
+        key, rest = s.split(":", 1)
+    else:
+        return [_unquote(s)]
+    out = [key.strip()]
+    rest = rest.strip()
+    if rest.startswith("[") and rest.endswith("]"):
+        out.extend(_unquote(p) for p in rest[1:-1].split(",") if p.strip())
+    elif rest:
+        out.append(_unquote(rest))
+    return out
 
 
-def _ensure_tun_route_exclude(text: str, cidrs: List[str]) -> Tuple[str, bool]:
+@dataclass
+class _YamlIndex:
+    """
+    One-pass index over the subscription lines (built once per patch run):
+      - blocks: top-level `key:` -> (start_idx, end_idx_exclusive)
+      - keys:   top-level key -> line idx (also matches `key: value` scalars)
+      - values: "key" / "key.child" -> {scalar: first line idx}; a block's own list items
+                and child keys go under "key", everything nested under a child key
+                (e.g. the `route-exclude-address` list of `tun`) under "key.child"
+      - items:  top-level key -> line idxs of the block's list items (`- ...`)
+    Mutations are queued with insert()/replace() in original line coordinates and
+    applied by render().
+    """
+
+    lines: List[str]
+    blocks: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    keys: Dict[str, int] = field(default_factory=dict)
+    values: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    items: Dict[str, List[int]] = field(default_factory=dict)
+    edits: List[Tuple[int, int, int, int, List[str]]] = field(default_factory=list)
+
+    @classmethod
+    def build(cls, lines: List[str]) -> "_YamlIndex":
+        index = cls(lines)
+        cur: Optional[str] = None
+        cur_start = 0
+        vals: Dict[str, int] = {}
+        child_vals: Dict[str, int] = {}
+        # values of the last `  key:` with no inline value: its indentless `  - item`s go there
+        seq_vals: Optional[Dict[str, int]] = None
+        items: List[int] = []
+        for i, ln in enumerate(lines):
+            s = ln.strip()
+            # Block continues over blank/comment/indented lines (and compact `- item` lists).
+            if not s or ln[0] in {" ", "#", "-"}:
+                if cur is None or not s or s.startswith("#"):
+                    continue
+                if " #" in s:
+                    s = s.split(" #", 1)[0].rstrip()
+                indent = len(ln) - len(ln.lstrip(" "))
+                if indent >= 4:
+                    for v in _line_scalars(s):
+                        child_vals.setdefault(v, i)
+                    continue
+                scalars = _line_scalars(s)
+                if s.startswith("-"):
+                    if indent == 2 and seq_vals is not None:
+                        # indentless sequence under a child key (`  key:\n  - a`)
+                        child_vals = seq_vals
+                        for v in scalars:
+                            child_vals.setdefault(v, i)
+                        continue
+                    items.append(i)
+                    child_vals = vals
+                elif scalars:
+                    # child key (`  key: ...`): its inline value and nested lines go to "cur.key"
+                    child_vals = index.values.setdefault(f"{cur}.{scalars[0]}", {})
+                    for v in scalars[1:]:
+                        child_vals.setdefault(v, i)
+                    seq_vals = child_vals if indent == 2 and len(scalars) == 1 else None
+                    scalars = scalars[:1]
+                for v in scalars:
+                    vals.setdefault(v, i)
+                continue
+
+            # A new top-level line closes the current block.
+            if cur is not None:
+                index.blocks[cur] = (cur_start, i)
+                cur = None
+            key, sep, rest = ln.partition(":")
+            if not sep:
+                continue
+            index.keys.setdefault(key, i)
+            # `key:` (optionally followed by trailing whitespace) opens a block.
+            if not rest.strip() and key not in index.blocks:
+                cur, cur_start = key, i
+                vals = child_vals = index.values[cur] = {}
+                seq_vals = None
+                items = index.items[cur] = []
+        if cur is not None:
+            index.blocks[cur] = (cur_start, len(lines))
+        return index
+
+    def block(self, key: str) -> Tuple[Optional[int], Optional[int]]:
+        span = self.blocks.get(key)
+        return span if span is not None else (None, None)
+
+    def insert(self, idx: int, new_lines: List[str], *, top_level: bool = False, after_prev: bool = False) -> None:
+        """
+        Queue `new_lines` before line `idx`. Inserts at the same index keep their queueing
+        order, except `top_level` ones (new top-level keys/blocks) which always land after
+        the ones appended to the tail of the preceding block, and `after_prev` ones
+        (anchored right after line idx-1) which always land first.
+        """
+        rank = 0 if after_prev else 2 if top_level else 1
+        self.edits.append((idx, idx, rank, len(self.edits), new_lines))
+
+    def replace(self, start: int, end: int, new_lines: List[str]) -> None:
+        self.edits.append((start, end, 1, len(self.edits), new_lines))
+
+    def render(self) -> List[str]:
+        """
+        Apply queued edits (in one forward pass over the sorted edits) and return the lines.
+        """
+        if not self.edits:
+            return self.lines
+        lines = self.lines
+        out: List[str] = []
+        pos = 0
+        for start, end, _, _, new_lines in sorted(self.edits):
+            if start > pos:
+                out.extend(lines[pos:start])
+            out.extend(new_lines)
+            pos = max(pos, end)
+        out.extend(lines[pos:])
+        self.lines = out
+        self.edits = []
+        return out
+
+
+def _ensure_tun_route_exclude(index: _YamlIndex, cidrs: List[str]) -> bool:
     if not cidrs:
-        return text, False
-    lines = _split_lines_keepends(text)
+        return False
+    lines = index.lines
+    # Everything already listed -> nothing to do.
+    existing = index.values.get("tun.route-exclude-address", {})
+    if set(cidrs).issubset(existing):
+        return False
 
-    tun_start, tun_end = _find_top_level_block(lines, "tun")
-    changed = False
+    tun_start, tun_end = index.block("tun")
 
     if tun_start is None:
         # Insert a minimal tun block before `proxies:` if possible, otherwise at EOF.
-        insert_at = None
-        for i, ln in enumerate(lines):
-            if ln.startswith("proxies:\n") or ln.rstrip("\n") == "proxies:":
-                insert_at = i
-                break
+        insert_at, _ = index.block("proxies")
         if insert_at is None:
             insert_at = len(lines)
             if insert_at > 0 and not lines[-1].endswith("\n"):
                 lines[-1] += "\n"
-        tun_block = []
-        tun_block.append("tun:\n")
-        tun_block.append("  enable: true\n")
-        tun_block.append("  stack: system\n")
-        tun_block.append("  auto-route: true\n")
-        tun_block.append("  auto-detect-interface: true\n")
-        tun_block.append("  dns-hijack:\n")
-        tun_block.append("    - any:53\n")
-        tun_block.append("  route-exclude-address:\n")
-        for c in cidrs:
-            tun_block.append(f"    - {c}\n")
-        tun_block.append("\n")
-        lines[insert_at:insert_at] = tun_block
-        return "".join(lines), True
-
-    # tun exists: ensure route-exclude-address contains cidrs
-    block = lines[tun_start:tun_end]
-    block_text = "".join(block)
+        tun_block = [
+            "tun:\n",
+            "  enable: true\n",
+            "  stack: system\n",
+            "  auto-route: true\n",
+            "  auto-detect-interface: true\n",
+            "  dns-hijack:\n",
+            "    - any:53\n",
+            "  route-exclude-address:\n",
+            *[f"    - {c}\n" for c in cidrs],
+            "\n",
+        ]
+        index.insert(insert_at, tun_block, top_level=True)
+        return True
+
+    # tun exists: ensure route-exclude-address contains cidrs (anywhere in the block counts)
+    block_text = "".join(islice(lines, tun_start, tun_end))
     missing = [c for c in cidrs if c not in block_text]
     if not missing:
-        return text, False
+        return False
 
     # Find route-exclude-address line inside tun block
     rex_idx = None
@@ -497,92 +717,42 @@ def _ensure_tun_route_exclude(text: str, cidrs: List[str]) -> Tuple[str, bool]:
 
     if rex_idx is None:
         # append new key at end of tun block (before first non-indented/top-level)
-        insert_at = tun_end
-        lines[insert_at:insert_at] = ["  route-exclude-address:\n"] + [f"    - {c}\n" for c in missing]
-        changed = True
-        return "".join(lines), changed
+        index.insert(tun_end, ["  route-exclude-address:\n"] + [f"    - {c}\n" for c in missing])
+        return True
 
     ln = lines[rex_idx]
     if "[" in ln and "]" in ln:
         # inline list: route-exclude-address: [a, b]
         open_i = ln.find("[")
         close_i = ln.rfind("]")
-        inner = ln[open_i + 1 : close_i]
-        new_items = []
-        for c in missing:
-            if c in inner:
-                continue
-            new_items.append(c)
-        if new_items:
-            inner2 = inner.rstrip()
-            if inner2 and not inner2.strip().endswith(","):
-                inner2 = inner2 + ", "
-            inner2 = inner2 + ", ".join(new_items)
-            lines[rex_idx] = ln[: open_i + 1] + inner2 + ln[close_i:]
-            changed = True
-        return "".join(lines), changed
+        inner2 = ln[open_i + 1 : close_i].rstrip()
+        if inner2 and not inner2.strip().endswith(","):
+            inner2 = inner2 + ", "
+        inner2 = inner2 + ", ".join(missing)
+        index.replace(rex_idx, rex_idx + 1, [ln[: open_i + 1] + inner2 + ln[close_i:]])
+        return True
 
     # multiline list: insert missing `-` items under the key
-    j = rex_idx + 1
-    while j < tun_end:
-        if lines[j].startswith("  ") and not lines[j].startswith("    "):
-            break
-        j += 1
-    insert_lines = []
-    for c in missing:
-        insert_lines.append(f"    - {c}\n")
-    lines[j:j] = insert_lines
-    changed = True
-    return "".join(lines), changed
-
-
-def _ensure_dns_fakeip_filter(text: str, patterns: List[str]) -> Tuple[str, bool]:
-    if not patterns:
-        return text, False
-    lines = _split_lines_keepends(text)
-    dns_start, dns_end = _find_top_level_block(lines, "dns")
-    if dns_start is None:
-        return text, False
+    j, prefix = _child_list_end(lines, rex_idx, tun_end)
+    index.insert(j, [f"{prefix}{c}\n" for c in missing])
+    return True
 
-    block_text = "".join(lines[dns_start:dns_end])
-    missing = [p for p in patterns if p not in block_text]
-    if not missing:
-        return text, False
 
-    # Locate fake-ip-filter within dns block
-    fidx = None
-    for i in range(dns_start + 1, dns_end):
-        if lines[i].lstrip().startswith("fake-ip-filter:"):
-            fidx = i
-            break
-    if fidx is None:
-        # append a new fake-ip-filter list at end of dns block
-        insert_at = dns_end
-        new_lines = ["  fake-ip-filter:\n"] + [f"    - {p}\n" for p in missing]
-        lines[insert_at:insert_at] = new_lines
-        return "".join(lines), True
-
-    ln = lines[fidx]
-    # inline list?
-    if "[" in ln and "]" in ln:
-        open_i = ln.find("[")
-        close_i = ln.rfind("]")
-        inner = ln[open_i + 1 : close_i]
-        inner2 = inner.rstrip()
-        if inner2 and not inner2.strip().endswith(","):
-            inner2 = inner2 + ", "
-        inner2 = inner2 + ", ".join([p for p in missing if p not in inner])
-        lines[fidx] = ln[: open_i + 1] + inner2 + ln[close_i:]
-        return "".join(lines), True
-
-    # multiline list: insert items after existing list items
-    j = fidx + 1
-    while j < dns_end:
-        if lines[j].startswith("  ") and not lines[j].startswith("    "):
+def _child_list_end(lines: List[str], key_idx: int, block_end: int) -> Tuple[int, str]:
+    """
+    End of the list under the child key at `key_idx`, and the item prefix to append with:
+    `  - ` when the list is an indentless sequence (`  key:\n  - a`), else `    - `.
+    """
+    prefix = "    - "
+    j = key_idx + 1
+    while j < block_end:
+        ln = lines[j]
+        if ln.startswith("  -"):
+            prefix = "  - "
+        elif ln.startswith("  ") and not ln.startswith("    "):
             break
         j += 1
-    lines[j:j] = [f"    - {p}\n" for p in missing]
-    return "".join(lines), True
+    return j, prefix
 
 
 def _yaml_inline_list(values: List[str]) -> str:
@@ -591,68 +761,99 @@ def _yaml_inline_list(values: List[str]) -> str:
     return "[" + ", ".join([f'"{v}"' for v in escaped]) + "]"
 
 
-def _ensure_dns_nameserver_policy(
-    text: str,
-    domain_patterns: List[str],
-    servers: List[str],
-) -> Tuple[str, bool]:
-    if not domain_patterns or not servers:
-        return text, False
-    lines = _split_lines_keepends(text)
-    dns_start, dns_end = _find_top_level_block(lines, "dns")
-    if dns_start is None:
-        return text, False
+_DNS_CHILD_KEYS = ("fake-ip-filter:", "nameserver-policy:")
+
 
-    block_text = "".join(lines[dns_start:dns_end])
-    # Find or create nameserver-policy block under dns
-    np_idx = None
+def _ensure_dns_block(
+    index: _YamlIndex,
+    fakeip_patterns: List[str],
+    nsp_domains: List[str],
+    nsp_servers: List[str],
+) -> Tuple[bool, bool]:
+    """
+    Ensure dns.fake-ip-filter lists `fakeip_patterns` and dns.nameserver-policy maps each of
+    `nsp_domains` to `nsp_servers`, locating both keys in a single walk of the dns block.
+    Returns (fake_ip_filter_changed, nameserver_policy_changed).
+    """
+    # Everything already listed -> nothing to do.
+    fip_existing = index.values.get("dns.fake-ip-filter", {})
+    nsp_existing = index.values.get("dns.nameserver-policy", {})
+    if set(fakeip_patterns).issubset(fip_existing) and (not nsp_servers or set(nsp_domains).issubset(nsp_existing)):
+        return False, False
+    dns_start, dns_end = index.block("dns")
+    if dns_start is None:
+        return False, False
+    lines = index.lines
+    # A pattern/domain mentioned anywhere in the dns block counts as present.
+    block_text = "".join(islice(lines, dns_start, dns_end))
+    fip_missing = [p for p in fakeip_patterns if p not in block_text]
+
+    # One walk: first line of each child key, and where its nested lines end
+    # (next 2-space-indented key, else end of the dns block).
+    at: Dict[str, int] = {}
+    end: Dict[str, int] = {}
+    indentless: "set[str]" = set()
     for i in range(dns_start + 1, dns_end):
-        if lines[i].lstrip().startswith("nameserver-policy:"):
-            np_idx = i
-            break
+        ln = lines[i]
+        if ln.startswith("  -"):
+            # indentless sequence item of the key above it
+            indentless.update(k for k in at if k not in end)
+        elif ln.startswith("  ") and not ln.startswith("    "):
+            for k in at:
+                end.setdefault(k, i)
+        s = ln.lstrip()
+        for k in _DNS_CHILD_KEYS:
+            if k not in at and s.startswith(k):
+                at[k] = i
+
+    fip_changed = False
+    if fip_missing:
+        fidx = at.get("fake-ip-filter:")
+        if fidx is None:
+            # append a new fake-ip-filter list at end of dns block
+            index.insert(dns_end, ["  fake-ip-filter:\n"] + [f"    - {p}\n" for p in fip_missing])
+        elif "[" in lines[fidx] and "]" in lines[fidx]:
+            # inline list
+            ln = lines[fidx]
+            open_i = ln.find("[")
+            close_i = ln.rfind("]")
+            inner = ln[open_i + 1 : close_i].rstrip()
+            if inner and not inner.strip().endswith(","):
+                inner = inner + ", "
+            inner = inner + ", ".join(fip_missing)
+            index.replace(fidx, fidx + 1, [ln[: open_i + 1] + inner + ln[close_i:]])
+        else:
+            # multiline list: insert items after existing list items
+            prefix = "  - " if "fake-ip-filter:" in indentless else "    - "
+            index.insert(end.get("fake-ip-filter:", dns_end), [f"{prefix}{p}\n" for p in fip_missing])
+        fip_changed = True
+
+    # Checked against the block as it reads after the fake-ip-filter update.
+    added = "\n".join(fip_missing)
+    nsp_missing = [d for d in nsp_domains if d not in block_text and d not in added] if nsp_servers else []
+    nsp_changed = False
+    if nsp_missing:
+        servers = _yaml_inline_list(nsp_servers)
+        entry_lines = [f'    "{dp}": {servers}\n' for dp in nsp_missing]
+        if "nameserver-policy:" not in at:
+            # append at end of dns block
+            index.insert(dns_end, ["  nameserver-policy:\n"] + entry_lines)
+        else:
+            # insert under existing nameserver-policy mapping
+            index.insert(end.get("nameserver-policy:", dns_end), entry_lines)
+        nsp_changed = True
 
-    changed = False
-    entry_lines = []
-    for dp in domain_patterns:
-        if dp in block_text:
-            continue
-        entry_lines.append(f'    "{dp}": {_yaml_inline_list(servers)}\n')
-
-    if not entry_lines:
-        return text, False
-
-    if np_idx is None:
-        # append at end of dns block
-        insert_at = dns_end
-        new_lines = ["  nameserver-policy:\n"] + entry_lines
-        lines[insert_at:insert_at] = new_lines
-        changed = True
-        return "".join(lines), changed
-
-    # insert under existing nameserver-policy mapping
-    j = np_idx + 1
-    while j < dns_end:
-        if lines[j].startswith("  ") and not lines[j].startswith("    "):
-            break
-        j += 1
-    lines[j:j] = entry_lines
-    changed = True
-    return "".join(lines), changed
+    return fip_changed, nsp_changed
 
 
-def _ensure_rules_bypass(text: str) -> Tuple[str, bool]:
+def _ensure_rules_bypass(index: _YamlIndex) -> bool:
     """
     Add rule-mode bypass rules near the top of `rules:` as a safety net.
     Note: In "global" style modes, these rules may be bypassed; TUN route-exclude is the key.
     """
-    lines = _split_lines_keepends(text)
-    rules_idx = None
-    for i, ln in enumerate(lines):
-        if ln.startswith("rules:\n") or ln.rstrip("\n") == "rules:":
-            rules_idx = i
-            break
+    rules_idx, _ = index.block("rules")
     if rules_idx is None:
-        return text, False
+        return False
 
     wanted: List[str] = []
     for cidr in BYPASS_IP_CIDRS:
@@ -663,78 +864,112 @@ def _ensure_rules_bypass(text: str) -> Tuple[str, bool]:
         ]
     )
 
-    # check if already present
-    rules_head = "".join(lines[rules_idx : min(len(lines), rules_idx + 200)])
+    # check if already present (only the first 200 lines count: the safety net must sit near the top)
+    rules_head = "".join(islice(index.lines, rules_idx, rules_idx + 200))
     missing = [r for r in wanted if r.strip() not in rules_head]
     if not missing:
-        return text, False
+        return False
+
+    index.insert(rules_idx + 1, missing)
+    return True
 
-    insert_at = rules_idx + 1
-    lines[insert_at:insert_at] = missing
-    return "".join(lines), True
 
-def _extract_proxy_names_from_proxies_section(proxies_section_text: str) -> List[str]:
+# quoted `name: '...'` / `name: "..."` lines
+_NAME_LINE_RE = re.compile(
+    r"^[ \t]*name:[ \t]*(?:'" + _SQ_BODY + "'|\"" + _DQ_BODY + r'")[ \t]*\r?$', re.MULTILINE
+)
+
+
+def _name_from_match(m: "re.Match[str]") -> str:
+    sq, dq = m.groups()
+    return _unescape_sq(sq) if sq is not None else _unescape_dq(dq)
+
+
+def _extract_proxy_names_from_lines(lines: List[str], start: int = 0, end: Optional[int] = None) -> List[str]:
+    """
+    Names of the quoted `name:` lines in lines[start:end], in order.
+    """
+    match = _NAME_LINE_RE.match
     names: List[str] = []
-    for ln in _split_lines_keepends(proxies_section_text):
-        s = ln.strip()
-        if not s.startswith("name: "):
+    for ln in islice(lines, start, end):
+        if "name:" not in ln:
             continue
-        if s.startswith("name: '") and s.endswith("'"):
-            names.append(s[len("name: '") : -1])
-        elif s.startswith('name: "') and s.endswith('"'):
-            names.append(s[len('name: "') : -1])
+        m = match(ln)
+        if m:
+            names.append(_name_from_match(m))
     return names
 
 
-def _match_name_patterns(name: str, patterns: List[str]) -> bool:
-    for pat in patterns:
-        if pat.startswith("re:"):
-            if re.search(pat[3:], name):
-                return True
-        else:
-            if fnmatch.fnmatchcase(name, pat):
-                return True
-    return False
+@functools.lru_cache(maxsize=None)
+def _compile_pattern_set(patterns: Tuple[str, ...]) -> Callable[[str], object]:
+    """
+    Matcher for a node-name pattern list (glob / "re:" entries): truthy when any entry
+    matches. Globs match the whole name case-sensitively, like fnmatch.fnmatchcase(), and
+    are fused into one compiled alternation. Each "re:" entry is compiled on its own and
+    used with re.search(), so inline flags such as "(?i)" only ever apply to that entry.
+    """
+    # One fused alternation rather than fnmatch.filter() per glob: filter() scans the names
+    # once per pattern, and it applies os.path.normcase(), which folds case on Windows.
+    globs = [f"(?:{fnmatch.translate(p)})" for p in patterns if not p.startswith("re:")]
+    tests = [re.compile(p[3:]).search for p in patterns if p.startswith("re:")]
+    if globs:
+        tests.insert(0, re.compile("|".join(globs)).match)
+    if len(tests) == 1:
+        return tests[0]
+    return lambda name: any(t(name) for t in tests)
+
+
+def _us_match() -> Callable[[str], object]:
+    return _compile_pattern_set(tuple(US_NODE_PATTERNS))
+
 
+def _hk_match() -> Callable[[str], object]:
+    return _compile_pattern_set(tuple(HK_NODE_PATTERNS))
 
-def _resolve_us_nodes(all_proxy_names_in_order: List[str]) -> List[str]:
-    matched = [n for n in all_proxy_names_in_order if _match_name_patterns(n, US_NODE_PATTERNS)]
-    matched = [n for n in matched if n != RESI_PROXY["name"]]
+
+def _resolve_us_nodes(all_proxy_names_in_order: List[str]) -> Sequence[str]:
+    resi_name = RESI_PROXY["name"]
+    matched = [n for n in filter(_us_match(), all_proxy_names_in_order) if n != resi_name]
     return matched if matched else US_NODES_FALLBACK
 
 
-def _resolve_hk_nodes(all_proxy_names_in_order: List[str]) -> List[str]:
-    matched = [n for n in all_proxy_names_in_order if _match_name_patterns(n, HK_NODE_PATTERNS)]
+def _resolve_hk_nodes(all_proxy_names_in_order: List[str]) -> Sequence[str]:
     # exclude both residential proxy names to avoid weird matching
-    matched = [n for n in matched if n not in {RESI_PROXY["name"], RESI_PROXY_VIA_HK_NAME}]
+    excluded = {RESI_PROXY["name"], RESI_PROXY_VIA_HK_NAME}
+    matched = [n for n in filter(_hk_match(), all_proxy_names_in_order) if n not in excluded]
     return matched if matched else HK_NODES_FALLBACK
 
 
 _FLAG_RE = re.compile(r"^(?P<flag>[\U0001F1E6-\U0001F1FF]{2})\s*(?P<rest>.+)$")
 
 
+@functools.lru_cache(maxsize=4096)
 def _parse_flag_label(name: str) -> Optional[Tuple[str, str]]:
+    """
+    "🇯🇵 日本  东京 01" -> ("🇯🇵", "日本 东京"): whitespace collapsed, a trailing numeric
+    index dropped; None when nothing but an index follows the flag.
+    """
     m = _FLAG_RE.match(name)
     if not m:
         return None
-    flag = m.group("flag")
-    rest = m.group("rest").strip()
-    parts = rest.split()
+    parts = m.group("rest").split()
     if parts and parts[-1].isdigit():
-        parts = parts[:-1]
-    label = " ".join(parts).strip()
-    return (flag, label) if label else None
+        parts.pop()
+    label = " ".join(parts)
+    return (m.group("flag"), label) if label else None
 
 
 def _resolve_region_groups(all_proxy_names_in_order: List[str], us_nodes: List[str]) -> List[Tuple[str, List[str]]]:
     if not AUTO_REGION_URLTEST_GROUPS:
         return []
     us_set = set(us_nodes)
-    groups: "OrderedDict[str, List[str]]" = OrderedDict()
+    resi_name = RESI_PROXY["name"]
+    parse = _parse_flag_label
+    groups: Dict[str, List[str]] = {}
     for n in all_proxy_names_in_order:
-        if n == RESI_PROXY["name"] or n in us_set:
+        if n == resi_name or n in us_set:
             continue
-        parsed = _parse_flag_label(n)
+        parsed = parse(n)
         if not parsed:
             continue
         flag, label = parsed
@@ -743,85 +978,63 @@ def _resolve_region_groups(all_proxy_names_in_order: List[str], us_nodes: List[s
     return [(g, nodes) for g, nodes in groups.items() if len(nodes) >= REGION_GROUP_MIN_SIZE]
 
 
-def _ensure_toplevel_port(text: str, desired_port: int) -> Tuple[str, bool]:
-    lines = _split_lines_keepends(text)
-    stop_idx = len(lines)
-    for k, ln in enumerate(lines):
-        if ln.startswith("dns:") or ln.startswith("proxies:"):
-            stop_idx = k
-            break
+def _ensure_toplevel_port(index: _YamlIndex, desired_port: int) -> bool:
+    lines = index.lines
+    stops = [k for k in (index.keys.get("dns"), index.keys.get("proxies")) if k is not None]
+    stop_idx = min(stops) if stops else len(lines)
 
-    changed = False
-    port_line_idx: Optional[int] = None
-    for k in range(stop_idx):
-        if lines[k].startswith("port: "):
-            port_line_idx = k
-            break
+    def before_stop(prefix: str) -> Optional[int]:
+        return next((k for k in range(stop_idx) if lines[k].startswith(prefix)), None)
 
+    port_line_idx = before_stop("port: ")
     if port_line_idx is None:
-        insert_after = None
-        for k in range(stop_idx):
-            if lines[k].startswith("mixed-port: "):
-                insert_after = k
-                break
+        insert_after = before_stop("mixed-port: ")
         if insert_after is not None:
-            lines.insert(insert_after + 1, f"port: {desired_port}\n")
-            changed = True
-        else:
-            lines.insert(stop_idx, f"port: {desired_port}\n")
-            changed = True
-    else:
-        desired = f"port: {desired_port}"
-        if lines[port_line_idx].strip() != desired:
-            lines[port_line_idx] = desired + "\n"
-            changed = True
-
-    return "".join(lines), changed
-
-
-def _find_list_item_block(lines: List[str], start_idx: int, dash_indent: str, name: str) -> Tuple[Optional[int], Optional[int]]:
-    i = start_idx
-    dash_line = dash_indent + "-\n"
-    dash_line_no_nl = dash_indent + "-"
-
-    def is_item_start(ln: str) -> bool:
-        return ln == dash_line or ln.rstrip("\n") == dash_line_no_nl
-
-    while i < len(lines):
-        if is_item_start(lines[i]):
-            j = i + 1
-            found = False
-            while j < len(lines) and not is_item_start(lines[j]):
-                if lines[j].lstrip().startswith("name: "):
-                    if f"name: '{name}'" in lines[j] or f'name: "{name}"' in lines[j]:
-                        found = True
-                        break
-                j += 1
-            if found:
-                k = i + 1
-                while k < len(lines) and not is_item_start(lines[k]):
-                    k += 1
-                return i, k
-            i = j if j > i else i + 1
+            index.insert(insert_after + 1, [f"port: {desired_port}\n"], after_prev=True)
         else:
-            i += 1
-    return None, None
+            index.insert(stop_idx, [f"port: {desired_port}\n"], top_level=True)
+        return True
+
+    desired = f"port: {desired_port}"
+    if lines[port_line_idx].strip() != desired:
+        index.replace(port_line_idx, port_line_idx + 1, [desired + "\n"])
+        return True
+    return False
 
 
-def _extract_group_names_from_proxy_groups_section(proxy_groups_section_text: str) -> List[str]:
+def _index_list_items(lines: List[str], section_start: int, section_end: int, dash_indent: str) -> Dict[str, Tuple[int, int]]:
     """
-    Best-effort: list proxy-group names in order from `proxy-groups:` section.
+    Map each list item's `name:` in lines[section_start:section_end] to its
+    (start_idx, end_idx_exclusive). An item starts at a bare `dash_indent + "-"` line and
+    runs until the next one (the last one runs to section_end). First name wins.
     """
-    names: List[str] = []
-    for ln in _split_lines_keepends(proxy_groups_section_text):
-        s = ln.strip()
-        if not s.startswith("name: "):
-            continue
-        if s.startswith("name: '") and s.endswith("'"):
-            names.append(s[len("name: '") : -1])
-        elif s.startswith('name: "') and s.endswith('"'):
-            names.append(s[len('name: "') : -1])
-    return names
+    dash_line = dash_indent + "-"
+    dash_lines = {dash_line, dash_line + "\n"}
+    starts = [i for i in range(section_start, section_end) if lines[i] in dash_lines]
+    starts.append(section_end)
+    index: Dict[str, Tuple[int, int]] = {}
+    for start, stop in zip(starts, starts[1:]):
+        for i in range(start + 1, stop):
+            s = lines[i].lstrip()
+            if s.startswith("name: "):
+                index.setdefault(_name_scalar(s[len("name: ") :]), (start, stop))
+                break
+    return index
+
+
+def _section_item_index(section_lines: List[str], dash_indent: str = "  ") -> Dict[str, Tuple[int, int]]:
+    """
+    _index_list_items() over a whole section slice (line 0 is the section header).
+    Callers patching one section several times build it once and pass it to the
+    section helpers below. The node-select/remove helpers keep a passed index valid
+    (_shift_item_spans); rebuild it only after _ensure_many_in_section_list changes.
+    """
+    return _index_list_items(section_lines, 1, len(section_lines), dash_indent)
+
+
+def _extract_group_names_from_lines(lines: List[str], start: int = 0, end: Optional[int] = None) -> List[str]:
+    # group items use the same quoted `name:` lines as proxies
+    return _extract_proxy_names_from_lines(lines, start, end)
 
 
 def _truthy_env(name: str) -> bool:
@@ -829,12 +1042,12 @@ def _truthy_env(name: str) -> bool:
     return v in {"1", "true", "yes", "y", "on"}
 
 
-def _resolve_node_select_group_name(proxy_groups_section_text: str) -> Optional[str]:
+def _resolve_node_select_group_name(proxy_groups_lines: List[str]) -> Optional[str]:
     """
     Decide which existing group to treat as "node select" (the UI-facing group to rewrite).
     If not found, return None and we will skip rewrite to avoid breaking non-standard YAML.
     """
-    names = _extract_group_names_from_proxy_groups_section(proxy_groups_section_text)
+    names = _extract_group_names_from_lines(proxy_groups_lines)
     if not names:
         return None
 
@@ -857,19 +1070,27 @@ def _resolve_node_select_group_name(proxy_groups_section_text: str) -> Optional[
     return None
 
 
-def _render_proxy_block() -> str:
+# Rendered resi proxy entry lines, fixed once env overrides are applied (set in main()).
+_RESI_PROXY_BLOCK_CACHE: Optional[List[str]] = None
+
+
+def _render_proxy_block_lines() -> List[str]:
+    return _RESI_PROXY_BLOCK_CACHE or _render_proxy_block_lines_uncached()
+
+
+def _render_proxy_block_lines_uncached() -> List[str]:
     # 住宅出口拨号走“前置出口-择优”（默认 all candidates -> url-test）
     dialer_target = GROUP_ALL_NODES_BEST
-    return (
-        "  -\n"
-        f"    name: '{RESI_PROXY['name']}'\n"
-        f"    type: {RESI_PROXY['type']}\n"
-        f"    server: {RESI_PROXY['server']}\n"
-        f"    port: {RESI_PROXY['port']}\n"
-        f"    username: '{RESI_PROXY['username']}'\n"
-        f"    password: '{RESI_PROXY['password']}'\n"
-        f"    dialer-proxy: '{dialer_target}'\n"
-    )
+    return [
+        "  -\n",
+        f"    name: '{_yaml_sq(RESI_PROXY['name'])}'\n",
+        f"    type: {RESI_PROXY['type']}\n",
+        f"    server: {RESI_PROXY['server']}\n",
+        f"    port: {RESI_PROXY['port']}\n",
+        f"    username: '{RESI_PROXY['username']}'\n",
+        f"    password: '{RESI_PROXY['password']}'\n",
+        f"    dialer-proxy: '{dialer_target}'\n",
+    ]
 
 
 def _render_proxy_block_via_hk() -> str:
@@ -889,68 +1110,59 @@ def _render_group_us_relay() -> str:
     raise RuntimeError("Use _render_group_us_relay_with_nodes(nodes) instead")
 
 
-def _render_group_us_relay_with_nodes(us_nodes: List[str]) -> str:
-    proxies_lines = "".join([f"      - '{n}'\n" for n in us_nodes])
-    return (
-        "  -\n"
-        f"    name: '{GROUP_US_RELAY}'\n"
-        "    type: url-test\n"
-        f"    url: '{HEALTHCHECK_URL}'\n"
-        f"    interval: {HEALTHCHECK_INTERVAL}\n"
-        f"    tolerance: {HEALTHCHECK_TOLERANCE}\n"
-        "    proxies:\n"
-        f"{proxies_lines}"
-    )
+# Fixed lines after `name:` in a url-test group.
+_URLTEST_GROUP_TAIL = (
+    "    type: url-test\n",
+    f"    url: '{HEALTHCHECK_URL}'\n",
+    f"    interval: {HEALTHCHECK_INTERVAL}\n",
+    f"    tolerance: {HEALTHCHECK_TOLERANCE}\n",
+    "    proxies:\n",
+)
 
 
-def _render_region_urltest_group(group_name: str, nodes: List[str]) -> str:
-    proxies_lines = "".join([f"      - '{n}'\n" for n in nodes])
-    return (
-        "  -\n"
-        f"    name: '{group_name}'\n"
-        "    type: url-test\n"
-        f"    url: '{HEALTHCHECK_URL}'\n"
-        f"    interval: {HEALTHCHECK_INTERVAL}\n"
-        f"    tolerance: {HEALTHCHECK_TOLERANCE}\n"
-        "    proxies:\n"
-        f"{proxies_lines}"
-    )
+# Entries rendered verbatim (unquoted) instead of as a quoted proxy/group name.
+_BUILTIN_ENTRY_LINES = {"DIRECT": "      - DIRECT\n"}
 
 
-def _render_group_all_nodes_best_with_nodes(nodes: List[str]) -> str:
-    proxies_lines = "".join([f"      - '{n}'\n" for n in nodes])
-    return (
-        "  -\n"
-        f"    name: '{GROUP_ALL_NODES_BEST}'\n"
-        "    type: url-test\n"
-        f"    url: '{HEALTHCHECK_URL}'\n"
-        f"    interval: {HEALTHCHECK_INTERVAL}\n"
-        f"    tolerance: {HEALTHCHECK_TOLERANCE}\n"
-        "    proxies:\n"
-        f"{proxies_lines}"
-    )
+def _render_group_entries(entries: List[str]) -> List[str]:
+    """
+    `proxies:` entry lines of a group, de-duplicated in order; builtins stay unquoted.
+    """
+    builtin = _BUILTIN_ENTRY_LINES.get
+    return [builtin(e) or f"      - '{_yaml_sq(e)}'\n" for e in dict.fromkeys(entries)]
+
+
+def _render_urltest_group_lines(group_name: str, nodes: Sequence[str]) -> List[str]:
+    return [
+        "  -\n",
+        f"    name: '{_yaml_sq(group_name)}'\n",
+        *_URLTEST_GROUP_TAIL,
+        *[f"      - '{_yaml_sq(n)}'\n" for n in nodes],
+    ]
+
+
+def _render_urltest_group(group_name: str, nodes: Sequence[str]) -> str:
+    return "".join(_render_urltest_group_lines(group_name, nodes))
+
+
+def _render_group_us_relay_with_nodes(us_nodes: Sequence[str]) -> str:
+    return _render_urltest_group(GROUP_US_RELAY, us_nodes)
+
+
+def _render_region_urltest_group(group_name: str, nodes: Sequence[str]) -> str:
+    return _render_urltest_group(group_name, nodes)
+
+
+def _render_group_all_nodes_best_lines(nodes: List[str]) -> List[str]:
+    return _render_urltest_group_lines(GROUP_ALL_NODES_BEST, nodes)
 
 
 def _render_group_dialer_selector(candidates: List[str]) -> str:
-    seen = set()
-    final: List[str] = []
-    for c in candidates:
-        if c in seen:
-            continue
-        seen.add(c)
-        final.append(c)
-    lines: List[str] = []
-    for c in final:
-        if c == "DIRECT":
-            lines.append("      - DIRECT\n")
-        else:
-            lines.append(f"      - '{c}'\n")
-    return (
-        "  -\n"
-        f"    name: '{GROUP_DIALER_SELECTOR}'\n"
-        "    type: select\n"
-        "    proxies:\n"
-        + "".join(lines)
+    return "".join(
+        [
+            f"  -\n    name: '{GROUP_DIALER_SELECTOR}'\n    type: select\n    proxies:\n",
+            *_render_group_entries(candidates),
+        ]
     )
 
 
@@ -976,188 +1188,406 @@ def _render_group_oneclick_hk() -> str:
     )
 
 
-def _ensure_in_section_list(section_text: str, item_name: str, rendered_block: str, dash_indent: str) -> Tuple[str, bool]:
-    lines = _split_lines_keepends(section_text)
-    start_idx = 1
-    bs, be = _find_list_item_block(lines, start_idx=start_idx, dash_indent=dash_indent, name=item_name)
-    changed = False
-    rendered_lines = _split_lines_keepends(rendered_block)
-    if bs is None:
-        lines[start_idx:start_idx] = rendered_lines
-        changed = True
-    else:
-        if "".join(lines[bs:be]) != rendered_block:
-            lines[bs:be] = rendered_lines
-            changed = True
-    return "".join(lines), changed
+def _shift_item_spans(item_index: Dict[str, Tuple[int, int]], pos: int, delta: int) -> None:
+    """
+    Keep an item index valid after `delta` lines were inserted (> 0) or removed (< 0) at
+    `pos`: spans starting at/after `pos` move, a span containing `pos` grows/shrinks.
+    """
+    for name, (s, e) in item_index.items():
+        if s >= pos:
+            item_index[name] = (s + delta, e + delta)
+        elif e >= pos:
+            item_index[name] = (s, e + delta)
+
+
+def _span_equals(lines: List[str], bs: int, be: int, block_lines: List[str]) -> bool:
+    return be - bs == len(block_lines) and lines[bs:be] == block_lines
 
 
-def _ensure_many_in_section_list(section_text: str, items: List[Tuple[str, str]], dash_indent: str) -> Tuple[str, bool]:
+def _ensure_in_section_list(
+    lines: List[str],
+    item_name: str,
+    rendered_lines: List[str],
+    dash_indent: str,
+    item_index: Optional[Dict[str, Tuple[int, int]]] = None,
+) -> Tuple[bool, Optional[str]]:
+    """
+    Ensure section `lines` (mutated in place) holds `rendered_lines` as item `item_name`.
+    Returns (changed, item_name if it was newly inserted at the top of the section else None),
+    so callers tracking the section's names can update them.
+    """
+    if item_index is None:
+        item_index = _section_item_index(lines, dash_indent)
+    span = item_index.get(item_name)
+    if span is None:
+        lines[1:1] = rendered_lines
+        return True, item_name
+    bs, be = span
+    if _span_equals(lines, bs, be, rendered_lines):
+        return False, None
+    lines[bs:be] = rendered_lines
+    return True, None
+
+
+def _ensure_many_in_section_list(
+    lines: List[str],
+    items: List[Tuple[str, List[str]]],
+    dash_indent: str,
+    item_index: Optional[Dict[str, Tuple[int, int]]] = None,
+) -> bool:
+    """
+    Batch form of _ensure_in_section_list(): one index, replacements bottom-up, and all
+    missing items inserted together right after the section header.
+    """
     if not items:
-        return section_text, False
-    lines = _split_lines_keepends(section_text)
-    changed = False
-    missing_blocks: List[str] = []
-
-    for name, block in items:
-        bs, be = _find_list_item_block(lines, start_idx=1, dash_indent=dash_indent, name=name)
-        if bs is None:
-            missing_blocks.append(block)
+        return False
+    if item_index is None:
+        item_index = _section_item_index(lines, dash_indent)
+    missing_blocks: List[List[str]] = []
+    replacements: Dict[int, Tuple[int, List[str]]] = {}
+
+    for name, block_lines in items:
+        span = item_index.get(name)
+        if span is None:
+            missing_blocks.append(block_lines)
             continue
-        if "".join(lines[bs:be]) != block:
-            lines[bs:be] = _split_lines_keepends(block)
-            changed = True
+        bs, be = span
+        if not _span_equals(lines, bs, be, block_lines):
+            replacements[bs] = (be, block_lines)
+
+    # bottom-up, so the indexed spans above each replacement stay valid
+    for bs in sorted(replacements, reverse=True):
+        be, block_lines = replacements[bs]
+        lines[bs:be] = block_lines
 
     if missing_blocks:
-        insert_at = 1
-        merged = "".join(missing_blocks)
-        lines[insert_at:insert_at] = _split_lines_keepends(merged)
-        changed = True
-    return "".join(lines), changed
+        lines[1:1] = chain.from_iterable(missing_blocks)
+    return bool(replacements or missing_blocks)
 
 
-def _set_group_proxies_exact(section_text: str, group_name: str, entries: List[str]) -> Tuple[str, bool]:
-    """
-    Rewrite `proxies:` list of a proxy-group to exactly `entries` (unique, preserve order).
-    """
-    seen = set()
-    final: List[str] = []
-    for e in entries:
-        if e in seen:
-            continue
-        seen.add(e)
-        final.append(e)
+_PROXIES_HEAD = "    proxies:"
+_PROXY_ITEM_PREFIX = "      -"
 
-    lines = _split_lines_keepends(section_text)
-    bs, be = _find_list_item_block(lines, start_idx=1, dash_indent="  ", name=group_name)
-    if bs is None:
-        raise ValueError(f"Missing proxy group {group_name!r} in proxy-groups section")
 
-    block = lines[bs:be]
+def _group_proxies_span(lines: List[str], bs: int, be: int, group_name: str) -> Tuple[int, int]:
+    """
+    One walk over a group item lines[bs:be]: return (idx of its `proxies:` line, end of the
+    contiguous `      -` entries right after it).
+    """
     proxies_idx = None
-    for i in range(len(block)):
-        if block[i].startswith("    proxies:"):
-            proxies_idx = i
-            break
+    for i in range(bs, be):
+        ln = lines[i]
+        if proxies_idx is None:
+            if ln.startswith(_PROXIES_HEAD):
+                proxies_idx = i
+        elif not ln.startswith(_PROXY_ITEM_PREFIX):
+            return proxies_idx, i
     if proxies_idx is None:
         raise ValueError(f"Group {group_name!r} missing proxies list")
+    return proxies_idx, be
 
-    k = proxies_idx + 1
-    while k < len(block) and block[k].startswith("      -"):
-        del block[k]
 
-    rendered: List[str] = []
-    for e in final:
-        if e == "DIRECT":
-            rendered.append("      - DIRECT\n")
-        else:
-            rendered.append(f"      - '{e}'\n")
+def _group_entry_names(lines: List[str], start: int, end: int) -> "set[str]":
+    """
+    Normalized (unquoted) names of the `      - ...` entries in lines[start:end], so bare,
+    single- and double-quoted spellings of the same entry compare equal. Other lines
+    (comments, blanks, keys) in the range are skipped.
+    """
+    return {
+        _name_scalar(ln.strip()[1:])
+        for ln in islice(lines, start, end)
+        if ln.startswith(_PROXY_ITEM_PREFIX)
+    }
+
+
+def _set_group_proxies_exact(
+    lines: List[str],
+    group_name: str,
+    entries: List[str],
+    item_index: Optional[Dict[str, Tuple[int, int]]] = None,
+) -> bool:
+    """
+    Rewrite `proxies:` list of a proxy-group to exactly `entries` (unique, preserve order).
+    """
+    if item_index is None:
+        item_index = _section_item_index(lines)
+    span = item_index.get(group_name)
+    if span is None:
+        raise ValueError(f"Missing proxy group {group_name!r} in proxy-groups section")
+    bs, be = span
+    proxies_idx, k = _group_proxies_span(lines, bs, be, group_name)
+
+    rendered = _render_group_entries(entries)
+    if lines[proxies_idx + 1 : k] == rendered:
+        return False
+    lines[proxies_idx + 1 : k] = rendered
+    return True
+
+
+def _ensure_node_select_contains(
+    lines: List[str],
+    group_name: str,
+    entry_name: str,
+    item_index: Optional[Dict[str, Tuple[int, int]]] = None,
+) -> bool:
+    if item_index is None:
+        item_index = _section_item_index(lines)
+    span = item_index.get(group_name)
+    if span is None:
+        raise ValueError(f"Missing proxy group {group_name!r} in proxy-groups section")
+    bs, be = span
+    proxies_idx, _ = _group_proxies_span(lines, bs, be, group_name)
+    # whole item, not just the contiguous entries: a comment/blank line may split the list
+    if entry_name in _group_entry_names(lines, bs, be):
+        return False
+    lines.insert(proxies_idx + 1, f"      - '{_yaml_sq(entry_name)}'\n")
+    _shift_item_spans(item_index, proxies_idx + 1, 1)
+    return True
+
+
+def _remove_group_by_name(
+    lines: List[str],
+    group_name: str,
+    item_index: Optional[Dict[str, Tuple[int, int]]] = None,
+) -> bool:
+    """
+    Remove a proxy-group block by name from `proxy-groups:` section lines.
+    Safe no-op if not present.
+    """
+    if item_index is None:
+        item_index = _section_item_index(lines)
+    span = item_index.get(group_name)
+    if span is None:
+        return False
+    bs, be = span
+    del lines[bs:be]
+    del item_index[group_name]
+    _shift_item_spans(item_index, be, bs - be)
+    return True
 
-    block[proxies_idx + 1 : proxies_idx + 1] = rendered
-    new_block = "".join(block)
-    old_block = "".join(lines[bs:be])
-    if new_block == old_block:
-        return section_text, False
 
-    lines[bs:be] = _split_lines_keepends(new_block)
-    return "".join(lines), True
+def _remove_node_select_entries(
+    lines: List[str],
+    group_name: str,
+    entry_names: List[str],
+    item_index: Optional[Dict[str, Tuple[int, int]]] = None,
+) -> bool:
+    """
+    Remove several entries from a select group's proxies list in one filtering pass.
+    """
+    if item_index is None:
+        item_index = _section_item_index(lines)
+    span = item_index.get(group_name)
+    if span is None:
+        return False
+    bs, be = span
+    targets = frozenset(
+        t
+        for n in entry_names
+        for t in (f"      - '{_yaml_sq(n)}'\n", f'      - "{n}"\n', f"      - {n}\n")
+    )
+    kept = [ln for ln in islice(lines, bs, be) if ln not in targets]
+    if len(kept) == be - bs:
+        return False
+    lines[bs:be] = kept
+    _shift_item_spans(item_index, be, len(kept) - (be - bs))
+    return True
 
 
-def _ensure_node_select_contains(section_text: str, group_name: str, entry_name: str) -> Tuple[str, bool]:
-    lines = _split_lines_keepends(section_text)
-    bs, be = _find_list_item_block(lines, start_idx=1, dash_indent="  ", name=group_name)
-    if bs is None:
-        raise ValueError(f"Missing proxy group {group_name!r} in proxy-groups section")
-    block = lines[bs:be]
-    block_text = "".join(block)
-    if f"      - '{entry_name}'\n" in block_text or f'      - "{entry_name}"\n' in block_text:
-        return section_text, False
-    proxies_idx = None
-    for i in range(len(block)):
-        if block[i].startswith("    proxies:"):
-            proxies_idx = i
-            break
-    if proxies_idx is None:
-        raise ValueError(f"Group {group_name!r} missing proxies list")
-    block.insert(proxies_idx + 1, f"      - '{entry_name}'\n")
-    lines[bs:be] = block
-    return "".join(lines), True
+# Files already known to be patched: resolved path -> [mtime_ns, size, config fingerprint, message].
+# Persisted across runs in _patch_cache_path().
+_PATCHED_CACHE: Optional[Dict[str, list]] = None
+# Entries recorded by this process and not yet written (see _flush_patch_cache()).
+_PATCHED_CACHE_UPDATES: Dict[str, list] = {}
+
+
+def _patch_cache_path() -> Path:
+    base = os.getenv("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "patch_clash_subscription" / "state.json"
+
+
+def _read_patch_cache() -> Dict[str, list]:
+    try:
+        data = json.loads(_patch_cache_path().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _load_patch_cache() -> Dict[str, list]:
+    global _PATCHED_CACHE
+    if _PATCHED_CACHE is None:
+        _PATCHED_CACHE = _read_patch_cache()
+    return _PATCHED_CACHE
+
+
+def _store_patch_cache(path: Path, fingerprint: str, msg: str) -> None:
+    """Record `path` as patched; written out by _flush_patch_cache()."""
+    try:
+        st = path.stat()
+    except OSError:
+        return
+    key = str(path.resolve())
+    entry = [st.st_mtime_ns, st.st_size, fingerprint, msg]
+    _load_patch_cache()[key] = entry
+    _PATCHED_CACHE_UPDATES[key] = entry
+
+
+def _take_patch_cache_updates() -> Dict[str, list]:
+    updates = dict(_PATCHED_CACHE_UPDATES)
+    _PATCHED_CACHE_UPDATES.clear()
+    return updates
 
 
-def _remove_group_by_name(section_text: str, group_name: str) -> Tuple[str, bool]:
+def _flush_patch_cache() -> None:
     """
-    Remove a proxy-group block by name from `proxy-groups:` section text.
-    Safe no-op if not present.
+    Merge this process's recorded entries into the state file (re-read first, so entries
+    from other runs survive) and swap it in atomically. Best-effort: a missing or
+    read-only cache dir never fails a patch run.
     """
-    lines = _split_lines_keepends(section_text)
-    bs, be = _find_list_item_block(lines, start_idx=1, dash_indent="  ", name=group_name)
-    if bs is None:
-        return section_text, False
-    del lines[bs:be]
-    return "".join(lines), True
+    updates = _take_patch_cache_updates()
+    if not updates:
+        return
+    cp = _patch_cache_path()
+    try:
+        cp.parent.mkdir(parents=True, exist_ok=True)
+        cache = _read_patch_cache()
+        cache.update(updates)
+        fd, tmp = tempfile.mkstemp(dir=cp.parent, prefix=cp.name + ".", suffix=".tmp")
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(tmp, cp)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
 
 
-def _remove_node_select_entry(section_text: str, group_name: str, entry_name: str) -> Tuple[str, bool]:
+def _patch_fingerprint(features: "set[str]", compat: str) -> str:
     """
-    Remove an entry from a select group's proxies list (best-effort).
+    Hash of everything besides the file itself that decides the patch output, so a cached
+    "already patched" verdict is dropped when features, env/.env values or this script change.
     """
-    lines = _split_lines_keepends(section_text)
-    bs, be = _find_list_item_block(lines, start_idx=1, dash_indent="  ", name=group_name)
-    if bs is None:
-        return section_text, False
-    block = lines[bs:be]
-    target1 = f"      - '{entry_name}'\n"
-    target2 = f'      - "{entry_name}"\n'
-    target3 = f"      - {entry_name}\n"
-    changed = False
-    k = 0
-    while k < len(block):
-        if block[k] in {target1, target2, target3}:
-            del block[k]
-            changed = True
+    # Every upper-case setting (including those _apply_env_overrides() derives from env) and
+    # the raw value of every *_ENV knob, so a new knob is covered without touching this list.
+    settings = sorted(
+        (k, v)
+        for k, v in globals().items()
+        if k.isupper() and isinstance(v, (str, int, bool, list, tuple, dict))
+    )
+    env = os.environ
+    parts = (
+        sorted(features),
+        compat,
+        settings,
+        [(v, env.get(v)) for k, v in settings if k.endswith("_ENV")],
+        _parse_csv_env_list(BYPASS_INTERNAL_DNS_ENV) if FEATURE_BYPASS in features else [],
+        os.stat(__file__).st_mtime_ns,
+    )
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+def _write_backup(path: Path, target: Path) -> Path:
+    """
+    Back up `target` (the real file behind `path`) as `<path>.bak.<timestamp>`, adding a
+    `.N` suffix instead of overwriting a backup from the same second. The backup is a
+    hardlink to the current inode, which the atomic replace in patch_file() leaves intact;
+    a byte copy is used where links are unsupported.
+    """
+    ts = _dt.datetime.now().strftime("%Y%m%d-%H%M%S")
+    base = path.with_suffix(path.suffix + f".bak.{ts}")
+    for n in count():
+        bak = base if n == 0 else base.with_name(f"{base.name}.{n}")
+        try:
+            os.link(target, bak)
+            return bak
+        except FileExistsError:
+            continue
+        except OSError:
+            pass
+        try:
+            with open(target, "rb") as src, open(bak, "xb") as dst:
+                shutil.copyfileobj(src, dst)
+            return bak
+        except FileExistsError:
             continue
-        k += 1
-    if not changed:
-        return section_text, False
-    lines[bs:be] = block
-    return "".join(lines), True
+    raise AssertionError("unreachable")
 
 
-def patch_file(path: Path, dry_run: bool, backup: bool, features: "set[str]", compat: str) -> Tuple[bool, str]:
-    original = path.read_text(encoding="utf-8")
-    text = original
+def _no_change_message(features: "set[str]", warn_notes: List[str]) -> str:
+    base = f"No changes needed. (features={_format_features(features)})"
+    if warn_notes:
+        base += "\nWarnings:\n- " + "\n- ".join(warn_notes)
+    return base
+
+
+def patch_file(
+    path: Path,
+    dry_run: bool,
+    backup: bool,
+    features: "set[str]",
+    compat: str,
+    use_cache: bool = True,
+    original: Optional[str] = None,
+) -> Tuple[bool, str, Optional[List[str]]]:
+    """
+    Patch `path` and return (changed, message, patched_lines). The patched lines are
+    returned even on dry-run, for --diff/--changelog. `original` is the file text if the
+    caller already read it.
+    With `use_cache`, a file whose (mtime, size) and config fingerprint match the last
+    run that left it fully patched is reported unchanged without being read or indexed;
+    patched_lines is then None. The cache is only updated by runs that may write the file.
+    """
+    fingerprint = _patch_fingerprint(features, compat) if use_cache else ""
+    if fingerprint:
+        hit = _load_patch_cache().get(str(path.resolve()))
+        st = path.stat()
+        if hit and hit[:3] == [st.st_mtime_ns, st.st_size, fingerprint]:
+            return False, hit[3], None
+        if dry_run:
+            fingerprint = ""
+
+    if original is None:
+        original = _read_yaml_text(path)
+    index = _YamlIndex.build(_split_lines_keepends(original))
     changed_any = False
     change_notes: List[str] = []
     warn_notes: List[str] = []
 
+    # Env-driven knobs, read once per run.
+    env = os.environ
+    dns_raw = env.get(BYPASS_INTERNAL_DNS_ENV, "").strip()
+    dialer_mode = env.get(RESI_DIALER_MODE_ENV, "all").strip().lower() or "all"
+    dialer_regex = env.get(RESI_DIALER_REGEX_ENV, "").strip()
+
     if FEATURE_BYPASS in features:
         # bypass (idempotent)
         if compat == "mihomo":
-            text, ch = _ensure_tun_route_exclude(text, BYPASS_IP_CIDRS)
+            ch = _ensure_tun_route_exclude(index, BYPASS_IP_CIDRS)
             changed_any |= ch
             if ch:
                 change_notes.append("bypass: updated tun.route-exclude-address")
         else:
             warn_notes.append("bypass: compat=classic -> skipping tun.route-exclude-address injection")
-        text, ch = _ensure_dns_fakeip_filter(text, BYPASS_FAKEIP_FILTER)
-        changed_any |= ch
-        if ch:
-            change_notes.append("bypass: updated dns.fake-ip-filter")
+        dns_list: List[str] = []
         if compat == "mihomo":
-            dns_raw = os.getenv(BYPASS_INTERNAL_DNS_ENV, "").strip()
             dns_list = _parse_csv_env_list(BYPASS_INTERNAL_DNS_ENV)
             if dns_raw.lower() in {"system", "auto"} and not dns_list:
                 warn_notes.append(
                     f"bypass: {BYPASS_INTERNAL_DNS_ENV}=system but no system DNS detected (scutil --dns returned none)"
                 )
-            text, ch = _ensure_dns_nameserver_policy(text, BYPASS_FAKEIP_FILTER, dns_list)
-            changed_any |= ch
-            if ch:
-                change_notes.append("bypass: updated dns.nameserver-policy")
         else:
-            if os.getenv(BYPASS_INTERNAL_DNS_ENV, "").strip():
+            if dns_raw:
                 warn_notes.append("bypass: compat=classic -> ignoring BYPASS_INTERNAL_DNS (nameserver-policy may be unsupported)")
-        text, ch = _ensure_rules_bypass(text)
+        fip_ch, nsp_ch = _ensure_dns_block(index, BYPASS_FAKEIP_FILTER, BYPASS_FAKEIP_FILTER, dns_list)
+        changed_any |= fip_ch or nsp_ch
+        if fip_ch:
+            change_notes.append("bypass: updated dns.fake-ip-filter")
+        if nsp_ch:
+            change_notes.append("bypass: updated dns.nameserver-policy")
+        ch = _ensure_rules_bypass(index)
         changed_any |= ch
         if ch:
             change_notes.append("bypass: inserted DIRECT rules into rules:")
@@ -1165,109 +1595,222 @@ def patch_file(path: Path, dry_run: bool, backup: bool, features: "set[str]", co
     if FEATURE_RESI in features:
         if compat != "mihomo":
             raise ValueError("resi feature requires mihomo/Clash.Meta core (dialer-proxy); set --compat mihomo or disable resi.")
-        if os.getenv(RESI_DIALER_MODE_ENV, "all").strip().lower() == "regex" and not os.getenv(RESI_DIALER_REGEX_ENV, "").strip():
+        if dialer_mode == "regex" and not dialer_regex:
             warn_notes.append(f"resi: {RESI_DIALER_MODE_ENV}=regex but {RESI_DIALER_REGEX_ENV} is empty; falling back to all")
-        text, ch = _ensure_toplevel_port(text, TOPLEVEL_PORT)
+        ch = _ensure_toplevel_port(index, TOPLEVEL_PORT)
         changed_any |= ch
         if ch:
             change_notes.append("resi: ensured top-level port")
 
-        proxies_start, proxy_groups_start = _section_bounds(text, "proxies:\n", "proxy-groups:\n")
-        proxies_section = text[proxies_start:proxy_groups_start]
-        proxies_section, ch = _ensure_in_section_list(
-            section_text=proxies_section,
+        proxies_start, proxies_end = _section_bounds(index, "proxies")
+        proxy_groups_start, proxy_groups_end = _section_bounds(index, "proxy-groups")
+        if "rules" not in index.blocks:
+            raise ValueError("Missing rules: section; can't safely patch proxy-groups.")
+
+        # Both sections are edited in place as line lists and queued back on the index once.
+        proxies_lines = index.lines[proxies_start:proxies_end]
+        # Names are collected once; the ensure below reports an insert so we can patch the list.
+        all_proxy_names = _extract_proxy_names_from_lines(proxies_lines)
+        ch, inserted_name = _ensure_in_section_list(
+            proxies_lines,
             item_name=RESI_PROXY["name"],
-            rendered_block=_render_proxy_block(),
+            rendered_lines=_render_proxy_block_lines(),
             dash_indent="  ",
         )
         changed_any |= ch
         if ch:
             change_notes.append("resi: ensured residential proxy in proxies:")
 
-        all_proxy_names = _extract_proxy_names_from_proxies_section(proxies_section)
-        all_nodes_best, warn = _select_dialer_candidates(all_proxy_names)
+        if inserted_name is not None:
+            all_proxy_names.insert(0, inserted_name)
+        all_nodes_best, warn = _select_dialer_candidates(all_proxy_names, mode=dialer_mode, pattern=dialer_regex)
         if warn:
             warn_notes.append(warn)
 
-        proxy_groups_end = text.find("\nrules:\n", proxy_groups_start)
-        if proxy_groups_end < 0:
-            proxy_groups_end = text.find("rules:\n", proxy_groups_start)
-        if proxy_groups_end < 0:
-            raise ValueError("Missing rules: section; can't safely patch proxy-groups.")
-        proxy_groups_section = text[proxy_groups_start:proxy_groups_end + 1]
+        proxy_groups_lines = index.lines[proxy_groups_start:proxy_groups_end]
+        # Item spans of proxy-groups, shared by the helpers below; rebuilt only after a change.
+        groups_index = _section_item_index(proxy_groups_lines)
 
         # resi group topology (minimal, per user request):
         # - only ONE extra group: GROUP_ALL_NODES_BEST (url-test) used as residential dialer-proxy
-        items: List[Tuple[str, str]] = []
+        items: List[Tuple[str, List[str]]] = []
         if ENABLE_ALL_NODES_BEST:
-            items.append((GROUP_ALL_NODES_BEST, _render_group_all_nodes_best_with_nodes(all_nodes_best)))
-        proxy_groups_section, ch_groups = _ensure_many_in_section_list(proxy_groups_section, items, dash_indent="  ")
+            items.append((GROUP_ALL_NODES_BEST, _render_group_all_nodes_best_lines(all_nodes_best)))
+        ch_groups = _ensure_many_in_section_list(proxy_groups_lines, items, dash_indent="  ", item_index=groups_index)
         changed_any |= ch_groups
         if ch_groups:
             change_notes.append("resi: ensured required proxy-groups")
+            groups_index = _section_item_index(proxy_groups_lines)
 
         # Ensure node-select contains the residential SOCKS5 node (append-only, do not wipe existing nodes)
         if _truthy_env(RESI_SKIP_NODE_SELECT_REWRITE_ENV):
             warn_notes.append("resi: RESI_SKIP_NODE_SELECT_REWRITE enabled -> skipping node-select update")
         else:
-            ns_name = _resolve_node_select_group_name(proxy_groups_section)
+            ns_name = _resolve_node_select_group_name(proxy_groups_lines)
             if not ns_name:
                 warn_notes.append("resi: could not detect node-select group name in YAML -> skipping node-select update to avoid breaking config")
             else:
                 try:
-                    proxy_groups_section, ch_ns = _ensure_node_select_contains(proxy_groups_section, ns_name, RESI_PROXY["name"])
+                    ch_ns = _ensure_node_select_contains(proxy_groups_lines, ns_name, RESI_PROXY["name"], item_index=groups_index)
                     changed_any |= ch_ns
                     if ch_ns:
                         change_notes.append(f"resi: appended residential node into {ns_name}")
                     # Cleanup legacy groups from older iterations (to reduce UI clutter)
-                    proxy_groups_section, ch_rm1 = _remove_group_by_name(proxy_groups_section, GROUP_DIALER_SELECTOR)
-                    proxy_groups_section, ch_rm2 = _remove_group_by_name(proxy_groups_section, GROUP_ONECLICK)
+                    ch_rm1 = _remove_group_by_name(proxy_groups_lines, GROUP_DIALER_SELECTOR, item_index=groups_index)
+                    ch_rm2 = _remove_group_by_name(proxy_groups_lines, GROUP_ONECLICK, item_index=groups_index)
                     changed_any |= (ch_rm1 or ch_rm2)
                     if ch_rm1 or ch_rm2:
                         change_notes.append("resi: removed legacy resi groups (dialer selector / residential outlet)")
-                    proxy_groups_section, _ = _remove_node_select_entry(proxy_groups_section, ns_name, GROUP_DIALER_SELECTOR)
-                    proxy_groups_section, _ = _remove_node_select_entry(proxy_groups_section, ns_name, GROUP_ONECLICK)
+                    _remove_node_select_entries(
+                        proxy_groups_lines, ns_name, [GROUP_DIALER_SELECTOR, GROUP_ONECLICK], item_index=groups_index
+                    )
                 except Exception as e:
                     warn_notes.append(f"resi: failed to update node-select group safely: {e}")
 
-        text = text[:proxies_start] + proxies_section + text[proxy_groups_start:]
-        pg_start = text.find("proxy-groups:\n", proxies_start)
-        pg_end = text.find("\nrules:\n", pg_start)
-        if pg_end < 0:
-            pg_end = text.find("rules:\n", pg_start)
-        if pg_start < 0 or pg_end < 0:
-            raise ValueError("Failed to re-locate proxy-groups/rules sections after patch.")
-        text = text[:pg_start] + proxy_groups_section + text[pg_end + 1 :]
+        index.replace(proxies_start, proxies_end, proxies_lines)
+        index.replace(proxy_groups_start, proxy_groups_end, proxy_groups_lines)
+
+    # Apply all queued line edits.
+    original_lines = index.lines
+    new_lines = index.render()
+    # An edit that rewrote lines to what they already were is not a change: no backup,
+    # no write.
+    if changed_any and new_lines == original_lines:
+        changed_any = False
 
     if not changed_any:
-        base = f"No changes needed. (features={_format_features(features)})"
-        if warn_notes:
-            base += "\nWarnings:\n- " + "\n- ".join(warn_notes)
-        return False, base
+        base = _no_change_message(features, warn_notes)
+        if fingerprint:
+            _store_patch_cache(path, fingerprint, base)
+        return False, base, new_lines
     if dry_run:
         msg = f"Dry-run: changes would be applied. (features={_format_features(features)})"
         if change_notes:
             msg += "\nPlanned changes:\n- " + "\n- ".join(change_notes)
         if warn_notes:
             msg += "\nWarnings:\n- " + "\n- ".join(warn_notes)
-        return True, msg
+        return True, msg, new_lines
 
+    # Write through the symlink (if any) so os.replace swaps the real file, not the link.
+    target = Path(os.path.realpath(path))
     if backup:
-        ts = _dt.datetime.now().strftime("%Y%m%d-%H%M%S")
-        bak = path.with_suffix(path.suffix + f".bak.{ts}")
-        bak.write_text(original, encoding="utf-8")
-    path.write_text(text, encoding="utf-8")
+        _write_backup(path, target)
+    # Unique temp name: concurrent runs on the same file never share a temp file.
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=target.name + ".", suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="utf-8", buffering=OUTPUT_BUFFER_SIZE) as f:
+            f.writelines(new_lines)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(target, tmp)
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    if fingerprint:
+        # The next run over this exact file would be a no-op; remember that verdict.
+        _store_patch_cache(path, fingerprint, _no_change_message(features, warn_notes))
     msg = f"Patched successfully. (features={_format_features(features)})"
     if change_notes:
         msg += "\nApplied changes:\n- " + "\n- ".join(change_notes)
     if warn_notes:
         msg += "\nWarnings:\n- " + "\n- ".join(warn_notes)
-    return True, msg
+    return True, msg, new_lines
+
+
+_HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@")
+
+
+def _unified_diff_changed_region(a: List[str], b: List[str], fromfile: str, tofile: str, n: int = 3) -> Iterator[str]:
+    """
+    difflib.unified_diff() restricted to the region between the common head and tail
+    of `a`/`b` (plus `n` context lines). Hunk headers are shifted back to whole-file
+    line numbers.
+    """
+    import difflib
+
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi and a[lo] == b[lo]:
+        lo += 1
+    ea, eb = len(a), len(b)
+    while ea > lo and eb > lo and a[ea - 1] == b[eb - 1]:
+        ea -= 1
+        eb -= 1
+    off = max(lo - n, 0)
+    ea, eb = min(ea + n, len(a)), min(eb + n, len(b))
+
+    def shift(m: "re.Match[str]") -> str:
+        return f"@@ -{int(m.group(1)) + off}{m.group(2) or ''} +{int(m.group(3)) + off}{m.group(4) or ''} @@"
+
+    for ln in difflib.unified_diff(a[off:ea], b[off:eb], fromfile=fromfile, tofile=tofile, n=n):
+        yield _HUNK_HEADER_RE.sub(shift, ln, count=1) if off and ln.startswith("@@") else ln
+
+
+def _process_path(p: Path, features: "set[str]", args: argparse.Namespace) -> Iterator[str]:
+    """Patch/diff/changelog one file per the CLI flags, yielding its output chunks in order."""
+    original = _read_yaml_text(p)
+    compat = _resolve_compat(args.compat, original)
+    if args.diff or args.changelog:
+        _, msg, new_lines = patch_file(
+            p,
+            dry_run=True,
+            backup=False,
+            features=features,
+            compat=compat,
+            use_cache=not args.no_cache,
+            original=original,
+        )
+
+        if args.changelog:
+            yield msg + "\n"
+            return
+
+        diff: Iterator[str] = iter(())
+        if new_lines is not None:
+            a = _split_lines_keepends(original)
+            diff = _unified_diff_changed_region(a, new_lines, fromfile=str(p), tofile=str(p) + " (patched)")
+        first = next(diff, None)
+        if first is None:
+            yield "No diff (already patched).\n"
+            return
+        yield first
+        yield from diff
+        yield "\n"
+        return
+
+    _, msg, _ = patch_file(
+        p,
+        dry_run=args.dry_run,
+        backup=not args.no_backup,
+        features=features,
+        compat=compat,
+        use_cache=not args.no_cache,
+        original=original,
+    )
+    yield msg + "\n"
+
+
+def _process_path_in_worker(p: Path, features: "set[str]", args: argparse.Namespace) -> Tuple[str, Dict[str, list]]:
+    """Worker side of batch mode: the output text plus the cache entries for the parent to write."""
+    try:
+        return "".join(_process_path(p, features, args)), _take_patch_cache_updates()
+    except BaseException:
+        _take_patch_cache_updates()
+        raise
+
+
+def _init_worker() -> None:
+    # Spawned workers inherit os.environ (incl. .env values) but not the derived globals.
+    global _RESI_PROXY_BLOCK_CACHE
+    _apply_env_overrides()
+    _RESI_PROXY_BLOCK_CACHE = _render_proxy_block_lines_uncached()
 
 
 def main() -> int:
+    global _RESI_PROXY_BLOCK_CACHE
+
     ap = argparse.ArgumentParser()
-    ap.add_argument("yaml_path", type=str, help="Path to the subscription YAML to patch")
+    ap.add_argument("yaml_path", type=str, nargs="+", help="Path(s) to the subscription YAML(s) to patch")
     ap.add_argument(
         "--features",
         type=str,
@@ -1290,22 +1833,36 @@ def main() -> int:
     ap.add_argument("--no-env-file", action="store_true", help="Do not load .env file automatically.")
     ap.add_argument("--dry-run", action="store_true", help="Do not write file; only report")
     ap.add_argument("--no-backup", action="store_true", help="Do not write .bak backup")
+    ap.add_argument("--no-cache", action="store_true", help="Ignore the already-patched cache and always re-parse")
+    ap.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="Worker processes when several files are given (default: one per CPU, capped at file count)",
+    )
     args = ap.parse_args()
+    if args.jobs < 0:
+        ap.error("--jobs must be >= 0")
 
     if not args.no_env_file and args.env_file:
         _load_env_file(args.env_file)
     _apply_env_overrides()
+    _RESI_PROXY_BLOCK_CACHE = _render_proxy_block_lines_uncached()
 
     if args.print_system_dns:
         for ns in _get_macos_system_dns():
             print(ns)
         return 0
 
-    p = Path(os.path.expanduser(args.yaml_path))
-    if not p.exists():
-        raise SystemExit(f"File not found: {p}")
-    original = p.read_text(encoding="utf-8")
-    compat = _resolve_compat(args.compat, original)
+    # One entry per real file: the same target reached twice (repeated arg, glob overlap,
+    # symlink) must not be patched by two workers at once.
+    unique: Dict[Path, Path] = {}
+    for x in args.yaml_path:
+        p = Path(os.path.expanduser(x))
+        if not p.exists():
+            raise SystemExit(f"File not found: {p}")
+        unique.setdefault(p.resolve(), p)
+    paths = list(unique.values())
     features = _parse_features(args.features)
     if args.no_resi_chain:
         features.discard(FEATURE_RESI)
@@ -1313,84 +1870,39 @@ def main() -> int:
         features.discard(FEATURE_BYPASS)
     if args.explain:
         print(_explain(features))
-        print(f"\nCompatibility: {compat}")
+        for p in paths:
+            compat = _resolve_compat(args.compat, _read_yaml_text(p))
+            print(f"\nCompatibility: {compat}" if len(paths) == 1 else f"\nCompatibility ({p}): {compat}")
         return 0
 
-    if args.diff or args.changelog:
-        changed, msg = patch_file(p, dry_run=True, backup=False, features=features, compat=compat)
-        # patch_file(dry_run=True) doesn't write; but we also need the patched text for diff.
-        # Re-run patch logic by calling patch_file on a temp path is too heavy; instead, directly compute by applying again:
-        # We intentionally reuse the same patch functions to build the new text.
-        new_text = original
-        # bypass
-        if FEATURE_BYPASS in features:
-            if compat == "mihomo":
-                new_text, _ = _ensure_tun_route_exclude(new_text, BYPASS_IP_CIDRS)
-            new_text, _ = _ensure_dns_fakeip_filter(new_text, BYPASS_FAKEIP_FILTER)
-            if compat == "mihomo":
-                dns_list = _parse_csv_env_list(BYPASS_INTERNAL_DNS_ENV)
-                new_text, _ = _ensure_dns_nameserver_policy(new_text, BYPASS_FAKEIP_FILTER, dns_list)
-            new_text, _ = _ensure_rules_bypass(new_text)
-        # resi
-        if FEATURE_RESI in features:
-            if compat != "mihomo":
-                raise ValueError("resi feature requires mihomo/Clash.Meta core (dialer-proxy); set --compat mihomo or disable resi.")
-            new_text, _ = _ensure_toplevel_port(new_text, TOPLEVEL_PORT)
-            proxies_start, proxy_groups_start = _section_bounds(new_text, "proxies:\n", "proxy-groups:\n")
-            proxies_section = new_text[proxies_start:proxy_groups_start]
-            proxies_section, _ = _ensure_in_section_list(
-                section_text=proxies_section,
-                item_name=RESI_PROXY["name"],
-                rendered_block=_render_proxy_block(),
-                dash_indent="  ",
-            )
-            all_proxy_names = _extract_proxy_names_from_proxies_section(proxies_section)
-            all_nodes_best, _ = _select_dialer_candidates(all_proxy_names)
-            proxy_groups_end = new_text.find("\nrules:\n", proxy_groups_start)
-            if proxy_groups_end < 0:
-                proxy_groups_end = new_text.find("rules:\n", proxy_groups_start)
-            if proxy_groups_end < 0:
-                raise ValueError("Missing rules: section; can't safely patch proxy-groups.")
-            proxy_groups_section = new_text[proxy_groups_start:proxy_groups_end + 1]
-            items: List[Tuple[str, str]] = []
-            if ENABLE_ALL_NODES_BEST:
-                items.append((GROUP_ALL_NODES_BEST, _render_group_all_nodes_best_with_nodes(all_nodes_best)))
-            proxy_groups_section, _ = _ensure_many_in_section_list(proxy_groups_section, items, dash_indent="  ")
-            # node-select update: ensure residential node exists; best-effort cleanup legacy groups
-            if not _truthy_env(RESI_SKIP_NODE_SELECT_REWRITE_ENV):
-                ns_name = _resolve_node_select_group_name(proxy_groups_section)
-                if ns_name:
-                    proxy_groups_section, _ = _ensure_node_select_contains(proxy_groups_section, ns_name, RESI_PROXY["name"])
-                    proxy_groups_section, _ = _remove_group_by_name(proxy_groups_section, GROUP_DIALER_SELECTOR)
-                    proxy_groups_section, _ = _remove_group_by_name(proxy_groups_section, GROUP_ONECLICK)
-                    proxy_groups_section, _ = _remove_node_select_entry(proxy_groups_section, ns_name, GROUP_DIALER_SELECTOR)
-                    proxy_groups_section, _ = _remove_node_select_entry(proxy_groups_section, ns_name, GROUP_ONECLICK)
-            new_text = new_text[:proxies_start] + proxies_section + new_text[proxy_groups_start:]
-            pg_start = new_text.find("proxy-groups:\n", proxies_start)
-            pg_end = new_text.find("\nrules:\n", pg_start)
-            if pg_end < 0:
-                pg_end = new_text.find("rules:\n", pg_start)
-            if pg_start < 0 or pg_end < 0:
-                raise ValueError("Failed to re-locate proxy-groups/rules sections after patch.")
-            new_text = new_text[:pg_start] + proxy_groups_section + new_text[pg_end + 1 :]
+    if len(paths) == 1:
+        try:
+            sys.stdout.writelines(_process_path(paths[0], features, args))
+        finally:
+            _flush_patch_cache()
+        return 0
 
-        if args.changelog:
-            print(msg)
-            return 0
-
-        if args.diff:
-            import difflib
-
-            a = original.splitlines(keepends=True)
-            b = new_text.splitlines(keepends=True)
-            diff = difflib.unified_diff(a, b, fromfile=str(p), tofile=str(p) + " (patched)")
-            out = "".join(diff)
-            print(out if out.strip() else "No diff (already patched).")
-            return 0
-
-    changed, msg = patch_file(p, dry_run=args.dry_run, backup=not args.no_backup, features=features, compat=compat)
-    print(msg)
-    return 0
+    # Files are independent; processes rather than threads (the work is CPU-bound).
+    from concurrent.futures import ProcessPoolExecutor
+
+    rc = 0
+    jobs = args.jobs or min(len(paths), os.cpu_count() or 1)
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as ex:
+            futures = [ex.submit(_process_path_in_worker, p, features, args) for p in paths]
+            for p, fut in zip(paths, futures):
+                try:
+                    out, updates = fut.result()
+                    _PATCHED_CACHE_UPDATES.update(updates)
+                except Exception as e:
+                    out = f"Failed: {e}\n"
+                    rc = 1
+                sys.stdout.write(f"==> {p} <==\n")
+                sys.stdout.write(out)
+    finally:
+        # Workers never write the state file; the parent writes it once for the batch.
+        _flush_patch_cache()
+    return rc
 
 
 if __name__ == "__main__":
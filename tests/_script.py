@@ -0,0 +1,66 @@
+"""Shared helpers: load the CLI script (its file name is not importable) as a module."""
+
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+SCRIPT = Path(__file__).resolve().parent.parent / "patch_clash_subscription.py.py"
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+def load_script(name: str = "patch_clash_subscription"):
+    """A fresh module instance, so globals set by one test never leak into another."""
+    spec = importlib.util.spec_from_file_location(name, SCRIPT)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[name] = mod  # dataclasses resolve annotations via sys.modules
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class ScriptTestCase(unittest.TestCase):
+    """
+    Runs each test with a clean RESI_*/BYPASS_* environment plus ENV, a private cache dir,
+    and a freshly loaded script configured the way main() configures it.
+    """
+
+    ENV = {
+        "RESI_SERVER": "1.2.3.4",
+        "RESI_PORT": "1080",
+        "RESI_USERNAME": "u",
+        "RESI_PASSWORD": "p",
+        "BYPASS_DOMAINS": "baidu.com,corp.example",
+        "BYPASS_INTERNAL_DNS": "10.0.0.2,10.0.0.3",
+    }
+
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        env = {k: v for k, v in os.environ.items() if not k.startswith(("RESI_", "BYPASS_"))}
+        env.update(self.ENV)
+        env["XDG_CACHE_HOME"] = str(self.tmp / "cache")
+        patcher = mock.patch.dict(os.environ, env, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pcs = self.configure()
+
+    def configure(self):
+        pcs = load_script()
+        pcs._apply_env_overrides()
+        pcs._RESI_PROXY_BLOCK_CACHE = pcs._render_proxy_block_lines_uncached()
+        return pcs
+
+    def write(self, text: str, name: str = "sub.yaml") -> Path:
+        path = self.tmp / name
+        path.write_text(text, encoding="utf-8")
+        return path
+
+    def patch(self, path: Path, features=("resi", "bypass"), compat: str = "mihomo", **kwargs):
+        kwargs.setdefault("dry_run", False)
+        kwargs.setdefault("backup", False)
+        kwargs.setdefault("use_cache", False)
+        return self.pcs.patch_file(path, features=set(features), compat=compat, **kwargs)
@@ -0,0 +1,66 @@
+"""Batch mode: several paths in one CLI run."""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from _script import FIXTURES, SCRIPT, ScriptTestCase
+
+
+class BatchTest(ScriptTestCase):
+    def run_cli(self, *argv: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, str(SCRIPT), "--no-env-file", "--no-backup", "--compat", "mihomo", *argv],
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            env=os.environ,
+            cwd=self.tmp,
+        )
+
+    def fixture(self, stem: str) -> str:
+        return (FIXTURES / f"{stem}.yaml").read_text(encoding="utf-8")
+
+    def expected(self, stem: str) -> str:
+        return (FIXTURES / "expected" / f"{stem}.resi-bypass.mihomo.yaml").read_text(encoding="utf-8")
+
+    def test_each_file_is_patched_once_and_cached_by_the_parent(self):
+        full, minimal = self.write(self.fixture("full"), "full.yaml"), self.write(self.fixture("minimal"), "minimal.yaml")
+        link = self.tmp / "link.yaml"
+        link.symlink_to(full)
+
+        res = self.run_cli(str(full), str(minimal), str(full), str(link), "--jobs", "2")
+        self.assertEqual(res.returncode, 0, res.stderr)
+        self.assertEqual(res.stdout.count("==> "), 2, res.stdout)
+        self.assertIn(f"==> {full} <==\nPatched successfully.", res.stdout)
+        self.assertIn(f"==> {minimal} <==\nPatched successfully.", res.stdout)
+        self.assertEqual(full.read_text(encoding="utf-8"), self.expected("full"))
+        self.assertEqual(minimal.read_text(encoding="utf-8"), self.expected("minimal"))
+
+        state = json.loads((self.tmp / "cache" / "patch_clash_subscription" / "state.json").read_text(encoding="utf-8"))
+        self.assertEqual(set(state), {str(full.resolve()), str(minimal.resolve())})
+
+        res = self.run_cli(str(full), str(minimal))
+        self.assertEqual(res.stdout.count("No changes needed."), 2, res.stdout)
+
+    def test_a_failing_file_does_not_stop_the_batch(self):
+        bad = self.write("proxies:\n  -\n    name: 'A'\n", "bad.yaml")
+        good = self.write(self.fixture("no_tun"), "good.yaml")
+
+        res = self.run_cli(str(bad), str(good))
+        self.assertEqual(res.returncode, 1, res.stderr)
+        self.assertIn(f"==> {bad} <==\nFailed: Missing section header", res.stdout)
+        self.assertIn(f"==> {good} <==\nPatched successfully.", res.stdout)
+        self.assertEqual(good.read_text(encoding="utf-8"), self.expected("no_tun"))
+
+    def test_negative_jobs_is_rejected(self):
+        path = self.write(self.fixture("minimal"))
+        res = self.run_cli(str(path), str(path), "--jobs", "-1")
+        self.assertEqual(res.returncode, 2)
+        self.assertIn("--jobs must be >= 0", res.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from _script import ScriptTestCase
+
+ENV_FILE = """\
+# comment
+export EXPORTED = 'x y'
+A="x"y"
+B='
+my-key=2
+C = c=d
+D=
+no equals sign
+"""
+
+
+class LoadEnvFileTest(ScriptTestCase):
+    ENV = {}
+
+    def test_split_on_first_equals_then_strip_one_pair_of_quotes(self):
+        path = self.write(ENV_FILE, ".env")
+        loaded = self.pcs._load_env_file(str(path))
+        self.assertEqual(loaded, ["EXPORTED", "A", "B", "my-key", "C", "D"])
+        env = self.pcs.os.environ
+        self.assertEqual(env["EXPORTED"], "x y")
+        self.assertEqual(env["A"], 'x"y')
+        self.assertEqual(env["B"], "")
+        self.assertEqual(env["my-key"], "2")
+        self.assertEqual(env["C"], "c=d")
+        self.assertEqual(env["D"], "")
+
+    def test_without_override_existing_values_win(self):
+        path = self.write("RESI_SERVER=file\nRESI_PORT=1\n", ".env")
+        self.pcs.os.environ["RESI_SERVER"] = "shell"
+        self.assertEqual(self.pcs._load_env_file(str(path), override=False), ["RESI_PORT"])
+        self.assertEqual(self.pcs.os.environ["RESI_SERVER"], "shell")
+
+
+if __name__ == "__main__":
+    unittest.main()
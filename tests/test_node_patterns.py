@@ -0,0 +1,47 @@
+import fnmatch
+import re
+import unittest
+
+from _script import load_script
+
+PATTERNS = ("🇺🇲 美国 *", "US *", "re:(?i)^united", "re:[0-9]{3}$")
+NAMES = ("US 01", "us 01", "USA", "x US 01", "United States 01", "UNITED 02", "abc 123", "🇺🇲 美国 01", "美国 01")
+
+
+def reference(name, patterns):
+    """Entry-by-entry matching: fnmatchcase() for globs, re.search() for "re:" entries."""
+    for pat in patterns:
+        if pat.startswith("re:"):
+            if re.search(pat[3:], name):
+                return True
+        elif fnmatch.fnmatchcase(name, pat):
+            return True
+    return False
+
+
+class PatternSetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pcs = load_script()
+
+    def test_matches_entry_by_entry_semantics(self):
+        for patterns in (PATTERNS, PATTERNS[:2], PATTERNS[2:], PATTERNS[2:3], ()):
+            match = self.pcs._compile_pattern_set(patterns)
+            for name in NAMES:
+                with self.subTest(patterns=patterns, name=name):
+                    self.assertEqual(bool(match(name)), reference(name, patterns))
+
+    def test_globs_are_case_sensitive(self):
+        match = self.pcs._compile_pattern_set(("US *",))
+        self.assertTrue(match("US 01"))
+        self.assertFalse(match("us 01"))
+
+    def test_inline_flags_stay_scoped_to_their_entry(self):
+        match = self.pcs._compile_pattern_set(("re:(?i)^hk", "re:^JP"))
+        self.assertTrue(match("hK 01"))
+        self.assertTrue(match("JP 01"))
+        self.assertFalse(match("jp 01"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+from _script import load_script
+
+pcs = load_script()
+
+
+class ParseFlagLabelTest(unittest.TestCase):
+    def test_collapses_internal_whitespace(self):
+        self.assertEqual(pcs._parse_flag_label("🇯🇵 日本  东京 01"), ("🇯🇵", "日本 东京"))
+
+    def test_drops_trailing_index(self):
+        self.assertEqual(pcs._parse_flag_label("🇯🇵 日本 01"), ("🇯🇵", "日本"))
+
+    def test_index_only_is_none(self):
+        self.assertIsNone(pcs._parse_flag_label("🇯🇵01"))
+        self.assertIsNone(pcs._parse_flag_label("🇯🇵 01"))
+
+    def test_unicode_digit_index_is_dropped(self):
+        # str.isdigit() semantics: a superscript digit counts as an index too
+        self.assertEqual(pcs._parse_flag_label("🇯🇵 日本 ¹"), ("🇯🇵", "日本"))
+        self.assertIsNone(pcs._parse_flag_label("🇯🇵 ¹"))
+
+    def test_no_flag_is_none(self):
+        self.assertIsNone(pcs._parse_flag_label("日本 01"))
+
+
+if __name__ == "__main__":
+    unittest.main()
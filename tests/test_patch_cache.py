@@ -0,0 +1,147 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+from _script import ScriptTestCase
+
+SUB = """\
+mixed-port: 7890
+proxies:
+  -
+    name: 'US 01'
+    type: ss
+  -
+    name: 'HK 01'
+    type: ss
+proxy-groups:
+  -
+    name: '🚀 节点选择'
+    type: select
+    proxies:
+      - 'US 01'
+      - 'HK 01'
+rules:
+  - MATCH,🚀 节点选择
+"""
+
+# Env knobs read by _apply_env_overrides() or patch_file(), with a value differing from ScriptTestCase.ENV.
+ENV_KNOBS = {
+    "RESI_SERVER": "5.6.7.8",
+    "RESI_PORT": "1081",
+    "RESI_USERNAME": "u2",
+    "RESI_PASSWORD": "p2",
+    "RESI_PROXY_NAME": "resi-2",
+    "RESI_GROUP_DIALER_NAME": "dialer-2",
+    "RESI_GROUP_ONECLICK_NAME": "oneclick-2",
+    "RESI_GROUP_NODE_SELECT_NAME": "select-2",
+    "RESI_GROUP_DIALER_SELECTOR_NAME": "selector-2",
+    "RESI_DIALER_MODE": "regex",
+    "RESI_DIALER_REGEX": "US",
+    "RESI_SKIP_NODE_SELECT_REWRITE": "1",
+    "RESI_NODE_SELECT_MODE": "x",
+    "BYPASS_IP_CIDRS": "10.0.0.0/8",
+    "BYPASS_DOMAINS": "corp.example",
+    "BYPASS_INTERNAL_DNS": "10.0.0.9",
+}
+
+# Module settings patch_file() reads, with a value differing from the default.
+SETTINGS = {
+    "ENABLE_ALL_NODES_BEST": False,
+    "ENABLE_DIALER_SELECTOR": True,
+    "AUTO_REGION_URLTEST_GROUPS": True,
+    "TOPLEVEL_PORT": 7892,
+    "US_NODE_PATTERNS": ("re:^US",),
+    "HEALTHCHECK_INTERVAL": 60,
+}
+
+
+class PatchCacheTest(ScriptTestCase):
+    def state(self) -> dict:
+        self.pcs._flush_patch_cache()
+        try:
+            return json.loads(self.pcs._patch_cache_path().read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+
+    def test_patched_file_is_recorded_and_then_skipped(self):
+        path = self.write(SUB)
+        changed, _, lines = self.patch(path, use_cache=True)
+        self.assertTrue(changed)
+        self.assertIsNotNone(lines)
+        self.assertIn(str(path.resolve()), self.state())
+
+        pcs = self.configure()
+        with mock.patch.object(pcs, "_read_yaml_text", side_effect=AssertionError("file was read")):
+            changed, msg, lines = pcs.patch_file(
+                path, features={"resi", "bypass"}, compat="mihomo", dry_run=False, backup=False, use_cache=True
+            )
+        self.assertFalse(changed)
+        self.assertIsNone(lines)
+        self.assertTrue(msg.startswith("No changes needed."), msg)
+
+    def test_edited_file_misses(self):
+        path = self.write(SUB)
+        self.patch(path, use_cache=True)
+        self.pcs._flush_patch_cache()
+        path.write_text(SUB, encoding="utf-8")
+        changed, _, lines = self.configure().patch_file(
+            path, features={"resi", "bypass"}, compat="mihomo", dry_run=False, backup=False, use_cache=True
+        )
+        self.assertTrue(changed)
+        self.assertIsNotNone(lines)
+
+    def test_read_only_and_uncached_runs_store_nothing(self):
+        path = self.write(SUB)
+        self.patch(path, dry_run=True, use_cache=True)
+        self.assertEqual(self.state(), {})
+        self.patch(path)
+        self.patch(path)
+        self.assertEqual(self.state(), {})
+
+    def test_flush_merges_with_entries_written_meanwhile(self):
+        a, b = self.write(SUB, "a.yaml"), self.write(SUB, "b.yaml")
+        other = self.configure()
+        self.patch(a, use_cache=True)
+        other.patch_file(b, features={"resi", "bypass"}, compat="mihomo", dry_run=False, backup=False, use_cache=True)
+        other._flush_patch_cache()
+        self.assertEqual(set(self.state()), {str(a.resolve()), str(b.resolve())})
+        self.assertEqual(os.listdir(self.pcs._patch_cache_path().parent), ["state.json"])
+
+
+class FingerprintTest(ScriptTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.path = self.write(SUB)
+        self.patch(self.path, use_cache=True)
+        self.pcs._flush_patch_cache()
+
+    def cached(self, pcs, features=("resi", "bypass"), compat="mihomo") -> bool:
+        _, _, lines = pcs.patch_file(
+            self.path, features=set(features), compat=compat, dry_run=True, backup=False, use_cache=True
+        )
+        return lines is None
+
+    def test_unchanged_config_hits(self):
+        self.assertTrue(self.cached(self.configure()))
+
+    def test_each_env_knob_misses(self):
+        for key, value in ENV_KNOBS.items():
+            with self.subTest(key=key), mock.patch.dict("os.environ", {key: value}):
+                self.assertFalse(self.cached(self.configure()))
+
+    def test_each_setting_misses(self):
+        for key, value in SETTINGS.items():
+            with self.subTest(key=key):
+                pcs = self.configure()
+                setattr(pcs, key, value)
+                self.assertFalse(self.cached(pcs))
+
+    def test_features_and_compat_miss(self):
+        pcs = self.configure()
+        self.assertFalse(self.cached(pcs, features=("bypass",)))
+        self.assertFalse(self.cached(pcs, features=("bypass",), compat="classic"))
+
+
+if __name__ == "__main__":
+    unittest.main()
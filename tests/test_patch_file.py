@@ -0,0 +1,123 @@
+import unittest
+
+from _script import ScriptTestCase
+
+try:
+    import yaml
+except ImportError:  # optional: only used to check the output still parses
+    yaml = None
+
+# Block sequences written the way PyYAML / serde_yaml emit them: `- item` at the key's indent.
+INDENTLESS = """\
+mixed-port: 7890
+dns:
+  enable: true
+  enhanced-mode: fake-ip
+  nameserver:
+  - 223.5.5.5
+  fake-ip-filter:
+  - '*.lan'
+  - localhost.ptlogin2.qq.com
+tun:
+  enable: true
+  route-exclude-address:
+  - 10.0.0.0/8
+  dns-hijack:
+  - any:53
+proxies:
+-
+  name: 'US 01'
+  type: ss
+proxy-groups:
+-
+  name: '🚀 节点选择'
+  type: select
+  proxies:
+  - 'US 01'
+rules:
+- MATCH,🚀 节点选择
+"""
+
+QUOTED_NAMES = """\
+mixed-port: 7890
+proxies:
+  -
+    name: 'US Let''s Go 01'
+    type: ss
+  -
+    name: "US a\\"b 02"
+    type: ss
+  -
+    name: 'HK 01'
+    type: ss
+proxy-groups:
+  -
+    name: '🚀 节点选择'
+    type: select
+    proxies:
+      - 'US Let''s Go 01'
+      - "US a\\"b 02"
+      - 'HK 01'
+rules:
+  - MATCH,🚀 节点选择
+"""
+
+
+class IndentlessSequenceTest(ScriptTestCase):
+    def test_bypass_items_keep_indentless_style_and_are_idempotent(self):
+        path = self.write(INDENTLESS)
+        changed, _, _ = self.patch(path, features=("bypass",))
+        self.assertTrue(changed)
+        out = path.read_text(encoding="utf-8")
+        for item in ("10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16", "+.baidu.com", "+.corp.example"):
+            self.assertIn(f"\n  - {item}\n", out)
+        self.assertNotIn("\n    - ", out)
+        if yaml is not None:
+            data = yaml.safe_load(out)
+            self.assertEqual(
+                data["tun"]["route-exclude-address"], ["10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"]
+            )
+            self.assertIn("+.corp.example", data["dns"]["fake-ip-filter"])
+
+        changed, msg, _ = self.patch(path, features=("bypass",))
+        self.assertFalse(changed, msg)
+        self.assertEqual(path.read_text(encoding="utf-8"), out)
+
+    def test_already_listed_indentless_items_are_not_reinserted(self):
+        text = INDENTLESS.replace(
+            "  - 10.0.0.0/8\n", "  - 10.0.0.0/8\n  - 172.16.0.0/12\n  - 192.168.0.0/16\n"
+        ).replace("  - localhost.ptlogin2.qq.com\n", "  - localhost.ptlogin2.qq.com\n  - +.baidu.com\n  - +.corp.example\n")
+        path = self.write(text)
+        self.patch(path, features=("bypass",))
+        out = path.read_text(encoding="utf-8")
+        self.assertEqual(out.count("192.168.0.0/16\n  dns-hijack"), 1)
+        self.assertEqual(out.count("- +.corp.example\n"), 1)
+
+
+class QuotedNameTest(ScriptTestCase):
+    def test_names_with_escaped_quotes_are_extracted(self):
+        lines = QUOTED_NAMES.splitlines(keepends=True)
+        self.assertEqual(
+            self.pcs._extract_proxy_names_from_lines(lines, 1, 11), ["US Let's Go 01", 'US a"b 02', "HK 01"]
+        )
+
+    def test_escaped_quote_names_reach_the_dialer_group_and_are_idempotent(self):
+        path = self.write(QUOTED_NAMES)
+        changed, _, _ = self.patch(path, features=("resi",))
+        self.assertTrue(changed)
+        out = path.read_text(encoding="utf-8")
+        self.assertIn("      - 'US Let''s Go 01'\n", out)
+        if yaml is not None:
+            groups = {g["name"]: g for g in yaml.safe_load(out)["proxy-groups"]}
+            dialers = groups["🧪 前置出口-择优"]["proxies"]
+            self.assertIn("US Let's Go 01", dialers)
+            self.assertIn('US a"b 02', dialers)
+            self.assertIn("🚀 前置-SOCKS5", groups["🚀 节点选择"]["proxies"])
+
+        changed, msg, _ = self.patch(path, features=("resi",))
+        self.assertFalse(changed, msg)
+        self.assertEqual(path.read_text(encoding="utf-8"), out)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+"""
+patch_file() against fixtures/: the output must match fixtures/expected/ byte for byte
+(produced by the original text-rewriting implementation with ScriptTestCase.ENV), and a
+second run must be a no-op.
+"""
+
+import unittest
+
+from _script import FIXTURES, ScriptTestCase
+
+MODES = (
+    (("resi", "bypass"), "mihomo"),
+    (("resi",), "mihomo"),
+    (("bypass",), "mihomo"),
+    (("bypass",), "classic"),
+)
+
+
+class RoundTripTest(ScriptTestCase):
+    def test_output_matches_expected_and_second_run_is_noop(self):
+        sources = sorted(FIXTURES.glob("*.yaml"))
+        self.assertTrue(sources)
+        for src in sources:
+            for features, compat in MODES:
+                expected = FIXTURES / "expected" / f"{src.stem}.{'-'.join(features)}.{compat}.yaml"
+                with self.subTest(expected.name):
+                    path = self.write(src.read_text(encoding="utf-8"), src.name)
+                    self.patch(path, features, compat)
+                    self.assertEqual(path.read_text(encoding="utf-8"), expected.read_text(encoding="utf-8"))
+
+                    changed, msg, _ = self.patch(path, features, compat)
+                    self.assertFalse(changed, msg)
+                    self.assertEqual(path.read_bytes(), expected.read_bytes())
+
+
+if __name__ == "__main__":
+    unittest.main()
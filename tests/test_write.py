@@ -0,0 +1,71 @@
+"""How patch_file() writes: atomic replace, backups, symlinks."""
+
+import os
+import stat
+import unittest
+from unittest import mock
+
+from _script import FIXTURES, ScriptTestCase
+
+SRC = (FIXTURES / "minimal.yaml").read_text(encoding="utf-8")
+EXPECTED = (FIXTURES / "expected" / "minimal.resi-bypass.mihomo.yaml").read_text(encoding="utf-8")
+
+
+class WriteTest(ScriptTestCase):
+    def fixed_clock(self):
+        clock = mock.MagicMock()
+        clock.datetime.now.return_value.strftime.return_value = "20260101-000000"
+        return mock.patch.object(self.pcs, "_dt", clock)
+
+    def listing(self):
+        return sorted(p.name for p in self.tmp.iterdir() if p.name != "cache")
+
+    def test_backup_keeps_the_original_and_no_temp_file_is_left(self):
+        path = self.write(SRC)
+        os.chmod(path, 0o640)
+        with self.fixed_clock():
+            self.patch(path, backup=True)
+        self.assertEqual(self.listing(), ["sub.yaml", "sub.yaml.bak.20260101-000000"])
+        self.assertEqual(path.read_text(encoding="utf-8"), EXPECTED)
+        self.assertEqual((self.tmp / "sub.yaml.bak.20260101-000000").read_text(encoding="utf-8"), SRC)
+        self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o640)
+
+    def test_backups_from_the_same_second_are_not_overwritten(self):
+        path = self.write(SRC)
+        second = SRC.replace("mode: rule", "mode: global")
+        with self.fixed_clock():
+            self.patch(path, backup=True)
+            path.write_text(second, encoding="utf-8")
+            self.patch(path, backup=True)
+        bak = self.tmp / "sub.yaml.bak.20260101-000000"
+        self.assertEqual(bak.read_text(encoding="utf-8"), SRC)
+        self.assertEqual(bak.with_name(bak.name + ".1").read_text(encoding="utf-8"), second)
+
+    def test_backup_falls_back_to_a_copy_without_hardlinks(self):
+        path = self.write(SRC)
+        with self.fixed_clock(), mock.patch.object(self.pcs.os, "link", side_effect=PermissionError):
+            self.patch(path, backup=True)
+        self.assertEqual((self.tmp / "sub.yaml.bak.20260101-000000").read_text(encoding="utf-8"), SRC)
+        self.assertEqual(path.read_text(encoding="utf-8"), EXPECTED)
+
+    def test_symlink_is_kept_and_its_target_patched(self):
+        real = self.write(SRC, "real.yaml")
+        link = self.tmp / "link.yaml"
+        link.symlink_to(real)
+        with self.fixed_clock():
+            self.patch(link, backup=True)
+        self.assertTrue(link.is_symlink())
+        self.assertEqual(real.read_text(encoding="utf-8"), EXPECTED)
+        self.assertEqual((self.tmp / "link.yaml.bak.20260101-000000").read_text(encoding="utf-8"), SRC)
+
+    def test_failed_replace_leaves_the_file_untouched(self):
+        path = self.write(SRC)
+        with mock.patch.object(self.pcs.os, "replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.patch(path)
+        self.assertEqual(path.read_text(encoding="utf-8"), SRC)
+        self.assertEqual(self.listing(), ["sub.yaml"])
+
+
+if __name__ == "__main__":
+    unittest.main()